@@ -1,7 +1,10 @@
 # piper_sdk/__init__.py
 
+from typing import TYPE_CHECKING
+
 from .client import (
     PiperClient,
+    create_session,
     PiperError,
     PiperConfigError,
     PiperLinkNeededError,
@@ -13,10 +16,23 @@ from .client import (
     PiperSecretAcquisitionError # <-- ADDED
 )
 
+if TYPE_CHECKING:
+    from .async_client import AsyncPiperClient
+
 __version__ = "0.7.0" # <-- UPDATED
 
+def __getattr__(name):
+    # AsyncPiperClient pulls in asyncio and httpx; sync-only users should not pay for importing them.
+    if name == "AsyncPiperClient":
+        from .async_client import AsyncPiperClient
+        globals()[name] = AsyncPiperClient
+        return AsyncPiperClient
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 __all__ = [
     "PiperClient",
+    "AsyncPiperClient",
+    "create_session",
     "PiperError",
     "PiperConfigError",
     "PiperLinkNeededError",
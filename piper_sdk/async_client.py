@@ -0,0 +1,267 @@
+# piper_sdk/async_client.py
+
+import asyncio
+import importlib.util
+import logging
+from typing import List, Dict, Any, Optional
+
+try:
+    import httpx # Optional: pip install "pyper-sdk[async]"
+except ImportError:
+    httpx = None
+
+_HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None # httpx needs 'h2' for HTTP/2; use it by default when present
+
+from .client import (
+    _PiperClientBase,
+    PiperError,
+    PiperConfigError,
+    PiperLinkNeededError,
+    PiperAuthError,
+    PiperGrantNeededError,
+    PiperForbiddenError,
+    _json_loads,
+    _json_dumps,
+)
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+class AsyncPiperClient(_PiperClientBase):
+    """
+    asyncio variant of PiperClient for agents running inside an event loop.
+
+    Accepts the same keyword configuration as PiperClient, except the requests-specific
+    session and pool options, and shares its caches, error storage and advice helpers
+    through their common base class. The network-facing methods (get_secret, is_grant_still_active,
+    discover_local_instance_id, prewarm and the advanced lookups) are coroutines backed by a single
+    httpx.AsyncClient. Concurrent lookups share one connection pool, multiplexed over HTTP/2 when
+    the 'h2' package is installed. Use one instance per event loop, and close it with aclose()
+    or 'async with'.
+    """
+    DEFAULT_ASYNC_MAX_CONNECTIONS: int = 32
+    DEFAULT_ASYNC_MAX_KEEPALIVE_CONNECTIONS: int = 16
+
+    def __init__(self,
+                 client_id: str,
+                 *,
+                 httpx_client: Optional["httpx.AsyncClient"] = None,
+                 http2: Optional[bool] = None,
+                 max_connections: int = DEFAULT_ASYNC_MAX_CONNECTIONS,
+                 max_keepalive_connections: int = DEFAULT_ASYNC_MAX_KEEPALIVE_CONNECTIONS,
+                 max_retries: int = _PiperClientBase.DEFAULT_MAX_RETRIES,
+                 **kwargs: Any):
+        if httpx is None:
+            raise ImportError("AsyncPiperClient requires httpx. Install it with: pip install \"pyper-sdk[async]\"")
+        if kwargs.pop('prewarm_connections', False):
+            logger.warning("prewarm_connections is not supported by AsyncPiperClient; await client.prewarm() from the event loop instead.")
+        if not isinstance(max_retries, int) or isinstance(max_retries, bool):
+            raise PiperConfigError("AsyncPiperClient max_retries must be an int (connection-failure retries); urllib3 Retry objects only apply to PiperClient.")
+        super().__init__(client_id, **kwargs)
+        self._discovery_async_lock: Optional[asyncio.Lock] = None # Created on first use so it binds to the running loop
+        if httpx_client is not None:
+            self._http = httpx_client
+            self._owns_http = False
+        else:
+            limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive_connections)
+            # httpx only retries failed connects; as in PiperClient the local Piper Link (http://) is not retried.
+            self._http = httpx.AsyncClient(mounts={
+                'https://': httpx.AsyncHTTPTransport(http2=_HTTP2_AVAILABLE if http2 is None else http2, limits=limits,
+                                                     retries=max_retries),
+                'http://': httpx.AsyncHTTPTransport(limits=limits),
+            })
+            self._owns_http = True
+        self._http.headers['User-Agent'] = self._user_agent
+
+    async def aclose(self) -> None:
+        """
+        Closes the httpx client when the SDK created it. Safe to call more than once. On a client
+        returned by with_overrides() or with_fallback() this does nothing; the httpx client belongs to the original.
+        """
+        if self._owns_http and self._resource_owner is None and not self._http.is_closed:
+            await self._http.aclose()
+
+    async def __aenter__(self) -> "AsyncPiperClient":
+        return self
+
+    async def __aexit__(self, exc_type: Any, exc_value: Any, traceback: Any) -> None:
+        await self.aclose()
+
+    async def prewarm(self, timeout: float = 2.0, discover_instance: bool = False) -> int:
+        if not self.client_initialization_ok or not self.use_piper:
+            logger.debug("prewarm skipped: client is misconfigured or Piper usage is disabled.")
+            return 0
+        urls = [url for url in (self.resolve_mapping_url, self.get_scoped_url, self.exchange_secret_url) if url]
+        heads = asyncio.gather(*(self._http.head(url, timeout=timeout) for url in urls), return_exceptions=True)
+        if discover_instance and self._should_prewarm_discovery():
+            results, _ = await asyncio.gather(heads, self.discover_local_instance_id())
+        else:
+            results = await heads
+        warmed = 0
+        for url, result in zip(urls, results):
+            if isinstance(result, BaseException): logger.debug("prewarm: could not reach %s: %s", url, result)
+            else: warmed += 1
+        logger.debug("prewarm: %d Piper endpoint(s) answered.", warmed)
+        return warmed
+
+    async def discover_local_instance_id(self, force_refresh: bool = False) -> Optional[str]:
+        answered, instance_id = self._discovery_shortcut(force_refresh)
+        if answered: return instance_id
+        state = self._discovery_state()
+        if state._discovery_async_lock is None: state._discovery_async_lock = asyncio.Lock()
+        async with state._discovery_async_lock:
+            # Another task may have finished discovery while this one waited for the lock.
+            answered, instance_id = self._discovery_shortcut(force_refresh)
+            if answered: return instance_id
+            return self._record_discovery_result(await self._query_local_instance_id())
+
+    async def _query_local_instance_id(self) -> Optional[str]:
+        logger.info("Attempting to discover Piper Link instanceId from: %s", self.piper_link_service_url)
+        try:
+            response = await self._http.get(self.piper_link_service_url, timeout=1.0)
+            response.raise_for_status()
+            return self._instance_id_from_link_context(_json_loads(response.content))
+        except httpx.ConnectError: logger.warning(f"Local Piper Link service not found/running at {self.piper_link_service_url}.")
+        except httpx.TimeoutException: logger.warning(f"Timeout connecting to local Piper Link service at {self.piper_link_service_url}.")
+        except httpx.HTTPError as e: logger.warning(f"Request error querying local Piper Link service at {self.piper_link_service_url}: {e}")
+        except ValueError as e: logger.warning(f"JSON decode error from local Piper Link service at {self.piper_link_service_url}: {e}")
+        except Exception as e: logger.error(f"Unexpected error querying local Piper Link service at {self.piper_link_service_url}: {e}", exc_info=True)
+        return None
+
+    async def _get_instance_id_for_api_call(self, piper_link_instance_id_for_call: Optional[str]) -> Optional[str]:
+        if piper_link_instance_id_for_call:
+            logger.debug("Using instance_id passed directly to API call method: %s", piper_link_instance_id_for_call)
+            return piper_link_instance_id_for_call
+        if self._configured_instance_id:
+            logger.debug("Using instance_id explicitly provided at PiperClient initialization: %s", self._configured_instance_id)
+            return self._configured_instance_id
+        if self.attempt_local_discovery:
+            return await self.discover_local_instance_id()
+        logger.debug("No explicit instance_id provided, and local discovery is disabled.")
+        return self._discovered_instance_id
+
+    async def _post_json(self, url: str, payload: Dict[str, Any], timeout: float) -> Any:
+        return await self._http.post(url, headers=self._json_headers, content=_json_dumps(payload), timeout=timeout)
+
+    async def _resolve_piper_variable(self, variable_name: str, instance_id_for_context: str, use_cache: bool = True) -> str:
+        normalized_name, cached_credential_id = self._lookup_credential_id(variable_name, instance_id_for_context, use_cache)
+        if cached_credential_id is not None: return cached_credential_id
+        try:
+            payload = self._resolve_payload(variable_name, normalized_name, instance_id_for_context)
+            response = await self._post_json(self.resolve_mapping_url, payload, timeout=12)
+            return self._handle_resolve_response(response, variable_name, normalized_name, instance_id_for_context)
+        except (PiperGrantNeededError, PiperAuthError, PiperForbiddenError, ValueError): raise
+        except httpx.HTTPError as e:
+            logger.error(f"Network error calling {self.resolve_mapping_url} for var '{normalized_name}'.", exc_info=True)
+            raise PiperError(f"Network error resolving variable: {e}") from e
+        except Exception as e:
+            logger.error(f"Unexpected error resolving variable '{normalized_name}': {e}", exc_info=True)
+            raise PiperError(f"Unexpected error resolving variable: {e}") from e
+
+    async def _fetch_piper_sts_token(self, credential_ids: List[str], instance_id_for_context: str) -> Dict[str, Any]:
+        cleaned_credential_ids = self._clean_credential_ids(credential_ids)
+        try:
+            payload = self._scoped_payload(cleaned_credential_ids, instance_id_for_context)
+            response = await self._post_json(self.get_scoped_url, payload, timeout=15)
+            return self._handle_scoped_response(response, cleaned_credential_ids, instance_id_for_context)
+        except (PiperAuthError, PiperForbiddenError, ValueError): raise
+        except httpx.HTTPError as e:
+            logger.error(f"Network error calling {self.get_scoped_url}.", exc_info=True)
+            raise PiperError(f"Network error getting scoped creds: {e}") from e
+        except Exception as e:
+            logger.error(f"Unexpected error getting scoped creds: {e}", exc_info=True)
+            raise PiperError(f"Unexpected error getting scoped creds: {e}") from e
+
+    async def _perform_piper_tier(self, variable_name: str, piper_link_instance_id_for_call: Optional[str], fetch_raw_secret: bool) -> Dict[str, Any]:
+        effective_instance_id = await self._get_instance_id_for_api_call(piper_link_instance_id_for_call)
+        if not effective_instance_id: raise self._link_needed_error(piper_link_instance_id_for_call)
+        logger.debug("GET_SECRET '%s': Using instance_id '%s' for Piper flow (Agent: %s...).", variable_name, effective_instance_id, self._client_id_short)
+        cached_secret_info = self._cached_piper_secret(variable_name, effective_instance_id, fetch_raw_secret)
+        if cached_secret_info is not None: return cached_secret_info
+        credential_id = await self._resolve_piper_variable(variable_name, effective_instance_id)
+        try:
+            piper_sts_response_data = await self._fetch_piper_sts_token([credential_id], effective_instance_id)
+        except PiperAuthError:
+            self._forget_credential_id(variable_name, effective_instance_id)
+            raise
+        granted_piper_cred_id = piper_sts_response_data.get('granted_credential_ids', [credential_id])[0]
+        if not fetch_raw_secret:
+            return self._remember_piper_secret(piper_sts_response_data, self._sts_secret_info(variable_name, piper_sts_response_data, granted_piper_cred_id, effective_instance_id))
+        exchange_payload = self._exchange_payload(variable_name, granted_piper_cred_id, effective_instance_id)
+        api_response = await self._post_json(self.exchange_secret_url, exchange_payload, timeout=10)
+        return self._remember_piper_secret(piper_sts_response_data, self._raw_secret_info(variable_name, api_response, granted_piper_cred_id, effective_instance_id))
+
+    async def _perform_get_secret(self, variable_name: str, piper_link_instance_id_for_call: Optional[str] = None, fetch_raw_secret: bool = False) -> Dict[str, Any]:
+        attempted_sources_summary: Dict[str, Any] = {}
+        if self.use_piper:
+            logger.info("GET_SECRET '%s': Attempting Piper tier.", variable_name)
+            try:
+                return await self._perform_piper_tier(variable_name, piper_link_instance_id_for_call, fetch_raw_secret)
+            except Exception as e:
+                attempted_sources_summary["Piper"] = self._piper_tier_failure(variable_name, e)
+        # The env and local-config tiers only touch process memory and a small local file.
+        return self._perform_fallback_tiers(variable_name, attempted_sources_summary)
+
+    async def get_secret(self, variable_name: str, piper_link_instance_id_for_call: Optional[str] = None, fetch_raw_secret: bool = False, raise_on_failure: bool = True) -> Optional[Dict[str, Any]]:
+        error_key_for_storage, early_failure = self._check_get_secret_call(variable_name, raise_on_failure)
+        if early_failure is not None: return early_failure
+        try:
+            secret_info = await self._perform_get_secret(error_key_for_storage, piper_link_instance_id_for_call, fetch_raw_secret)
+            self._last_get_secret_errors.pop(error_key_for_storage, None)
+            return secret_info
+        except Exception as e:
+            return self._get_secret_failed(error_key_for_storage, e, raise_on_failure)
+
+    async def get_secrets(self, variable_names: List[str], piper_link_instance_id_for_call: Optional[str] = None, fetch_raw_secret: bool = False, raise_on_failure: bool = True) -> Dict[str, Optional[Dict[str, Any]]]:
+        unique_names = self._check_get_secrets_argument(variable_names)
+        results = await asyncio.gather(*(self.get_secret(name, piper_link_instance_id_for_call, fetch_raw_secret, raise_on_failure) for name in unique_names), return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException): raise result # First failure in the given order, as in the sync client
+        return dict(zip(unique_names, results))
+
+    async def is_grant_still_active(self, variable_name: str,
+                                    piper_link_instance_id_for_call: Optional[str] = None,
+                                    store_error_if_inactive: bool = True) -> bool:
+        error_key_for_storage = self._check_grant_check_call(variable_name, store_error_if_inactive)
+        if error_key_for_storage is None: return True
+        try:
+            effective_instance_id = await self._get_instance_id_for_api_call(piper_link_instance_id_for_call)
+            if not effective_instance_id:
+                raise PiperLinkNeededError("Instance ID required for grant check, but not available (discovery disabled or failed, and none provided).")
+        except PiperLinkNeededError as e_link_direct:
+            if store_error_if_inactive: self._last_get_secret_errors[error_key_for_storage] = e_link_direct
+            raise
+        try:
+            credential_id = await self._resolve_piper_variable(error_key_for_storage, effective_instance_id, use_cache=False)
+        except (PiperError, ValueError) as e:
+            return self._grant_check_failed(error_key_for_storage, e, store_error_if_inactive)
+        return self._grant_check_passed(error_key_for_storage, credential_id)
+
+    async def get_credential_id_for_variable(self, variable_name: str, piper_link_instance_id_for_call: Optional[str] = None) -> str:
+        logger.warning("get_credential_id_for_variable is an advanced method; prefer get_secret().")
+        self._ensure_piper_available("Cannot get credential_id: Piper usage is disabled in client configuration.")
+        target_instance_id = await self._get_instance_id_for_api_call(piper_link_instance_id_for_call)
+        if not target_instance_id: raise PiperLinkNeededError("Instance ID required for resolving variable (neither provided nor discovered via Piper Link when enabled).")
+        return await self._resolve_piper_variable(self._clean_variable_name_for_lookup(variable_name), target_instance_id)
+
+    async def get_scoped_credentials_by_id(self, credential_ids: List[str], piper_link_instance_id_for_call: Optional[str] = None) -> Dict[str, Any]:
+        logger.warning("get_scoped_credentials_by_id is an advanced method; prefer get_secret().")
+        self._ensure_piper_available("Cannot get scoped credentials by ID: Piper usage is disabled in client configuration.")
+        target_instance_id = await self._get_instance_id_for_api_call(piper_link_instance_id_for_call)
+        if not target_instance_id: raise PiperLinkNeededError("Instance ID required for fetching scoped credentials (neither provided nor discovered via Piper Link when enabled).")
+        self._check_credential_ids_argument(credential_ids)
+        return await self._fetch_piper_sts_token(credential_ids, target_instance_id)
+
+    async def get_scoped_credentials_for_variables(self, variable_names: List[str], piper_link_instance_id_for_call: Optional[str] = None) -> Dict[str, Any]:
+        """Async counterpart of PiperClient.get_scoped_credentials_for_variables; uncached names are resolved with asyncio.gather."""
+        logger.warning("get_scoped_credentials_for_variables is an advanced method; prefer get_secret().")
+        self._ensure_piper_available("Cannot get scoped credentials for variables: Piper usage is disabled in client configuration.")
+        stripped_names = self._check_variable_names_argument(variable_names)
+        target_instance_id = await self._get_instance_id_for_api_call(piper_link_instance_id_for_call)
+        if not target_instance_id: raise PiperLinkNeededError("Instance ID required for fetching scoped credentials (neither provided nor discovered via Piper Link when enabled).")
+        credential_ids_by_variable, uncached_names = self._split_cached_credential_ids(stripped_names, target_instance_id)
+        resolved = await asyncio.gather(*(self._resolve_piper_variable(name, target_instance_id) for name in uncached_names))
+        credential_ids_by_variable.update(zip(uncached_names, resolved))
+        scoped_data = await self._fetch_piper_sts_token(self._unique_credential_ids(stripped_names, credential_ids_by_variable), target_instance_id)
+        scoped_data['credential_ids_by_variable'] = {name: credential_ids_by_variable[name] for name in stripped_names}
+        return scoped_data
@@ -2,37 +2,57 @@
 
 import os
 import re
+import time
+import functools
+import copy
+import socket
 import requests
-from urllib.parse import urlencode, quote_plus as _quote_plus 
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib.parse import urlencode, urlsplit, quote_plus as _quote_plus 
 import logging
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional, Tuple, TypeVar, Union
 import json
+import threading
+import concurrent.futures
+
+try:
+    import orjson # Optional speedup: pip install "pyper-sdk[speedups]"
+    _json_loads = orjson.loads
+    def _json_dumps(obj: Any) -> bytes: return orjson.dumps(obj)
+except ImportError:
+    _json_loads = json.loads
+    def _json_dumps(obj: Any) -> bytes: return json.dumps(obj, separators=(',', ':')).encode('utf-8')
 
 logger = logging.getLogger(__name__)
-if not logger.handlers:
-    _default_handler = logging.StreamHandler()
-    _default_formatter = logging.Formatter('%(asctime)s - PiperSDK - %(levelname)s - %(message)s')
-    _default_handler.setFormatter(_default_formatter)
-    logger.addHandler(_default_handler)
-    logger.setLevel(logging.INFO) 
-    logger.propagate = False 
+logger.addHandler(logging.NullHandler()) # Library logger: the embedding application decides where (and whether) records go
 
 class PiperError(Exception): pass
 class PiperConfigError(PiperError): pass
 class PiperLinkNeededError(PiperConfigError):
     def __init__(self, message="Piper Link instanceId not provided and could not be discovered. Is Piper Link app running?"):
         super().__init__(message)
-class PiperAuthError(PiperError):
+class _StatusErrorStrMixin:
+    """Formats message + status/code/details once; the error is usually stringified by several log lines and the final summary."""
+    def __str__(self):
+        formatted = self.__dict__.get('_formatted_str')
+        if formatted is None:
+            details_str = f", Details: {self.error_details}" if self.error_details is not None else ""
+            status_str = f" (Status: {self.status_code})" if self.status_code is not None else ""
+            code_str = f" (Code: {self.error_code})" if self.error_code else ""
+            formatted = f"{super().__str__()}{status_str}{code_str}{details_str}"
+            self.__dict__['_formatted_str'] = formatted
+        return formatted
+    def __setattr__(self, name, value):
+        self.__dict__.pop('_formatted_str', None) # Reassigning a field invalidates the cached text
+        super().__setattr__(name, value)
+
+class PiperAuthError(_StatusErrorStrMixin, PiperError):
     def __init__(self, message: str, status_code: Optional[int] = None, error_code: Optional[str] = None, error_details: Optional[Any] = None):
         super().__init__(message)
         self.status_code = status_code
         self.error_code = error_code
         self.error_details = error_details
-    def __str__(self):
-        details_str = f", Details: {self.error_details}" if self.error_details is not None else ""
-        status_str = f" (Status: {self.status_code})" if self.status_code is not None else ""
-        code_str = f" (Code: {self.error_code})" if self.error_code else ""
-        return f"{super().__str__()}{status_str}{code_str}{details_str}"
 
 class PiperGrantError(PiperAuthError):
     def __init__(self,
@@ -51,16 +71,20 @@ class PiperGrantError(PiperAuthError):
         
         if self.piper_ui_grant_url_template and self.agent_id_for_grant and self.variable_name_requested:
             try:
-                base_url = self.piper_ui_grant_url_template.rstrip('/')
-                params = {
-                    'response_type': 'code',
-                    'scope': 'manage_grants', 
-                    'client': self.agent_id_for_grant, 
-                    'variable': self.variable_name_requested 
-                }
-                self.constructed_grant_url = f"{base_url}?{urlencode(params, quote_via=_quote_plus)}"
+                self.constructed_grant_url = self._grant_url_prefix(self.piper_ui_grant_url_template, self.agent_id_for_grant) + _quote_plus(self.variable_name_requested)
             except Exception as e_url: 
                 logger.warning(f"PiperSDK: Could not construct Piper UI grant URL: {e_url}")
+
+    @staticmethod
+    @functools.lru_cache(maxsize=32)
+    def _grant_url_prefix(piper_ui_grant_url_template: str, agent_id_for_grant: str) -> str:
+        """Everything up to the 'variable' value; only that part differs between grant errors of one client."""
+        params = {
+            'response_type': 'code',
+            'scope': 'manage_grants',
+            'client': agent_id_for_grant,
+        }
+        return f"{piper_ui_grant_url_template.rstrip('/')}?{urlencode(params, quote_via=_quote_plus)}&variable="
     
     def __str__(self):
         base_str = super().__str__()
@@ -75,17 +99,12 @@ class PiperGrantNeededError(PiperGrantError):
 class PiperForbiddenError(PiperAuthError):
     def __init__(self, message: str, status_code: Optional[int] = 403, error_code: Optional[str] = 'permission_denied', error_details: Optional[Any] = None):
         super().__init__(message, status_code, error_code, error_details)
-class PiperRawSecretExchangeError(PiperError):
+class PiperRawSecretExchangeError(_StatusErrorStrMixin, PiperError):
     def __init__(self, message: str, status_code: Optional[int] = None, error_code: Optional[str] = None, error_details: Optional[Any] = None):
         super().__init__(message)
         self.status_code = status_code
         self.error_code = error_code
         self.error_details = error_details
-    def __str__(self):
-        details_str = f", Details: {self.error_details}" if self.error_details is not None else ""
-        status_str = f" (Status: {self.status_code})" if self.status_code is not None else ""
-        code_str = f" (Code: {self.error_code})" if self.error_code else ""
-        return f"{super().__str__()}{status_str}{code_str}{details_str}"
 class PiperSecretAcquisitionError(PiperError):
     def __init__(self, message: str, variable_name: str, attempted_sources_summary: Dict[str, Any]):
         super().__init__(message)
@@ -102,13 +121,25 @@ class PiperSecretAcquisitionError(PiperError):
         for source, error_info in self.attempted_sources_summary.items():
             if source == "Piper" and isinstance(piper_error, (PiperGrantNeededError, PiperLinkNeededError)) and len(self.attempted_sources_summary) > 1 :
                  if not details[-1].startswith("Details of all attempts:"): details.append("Details of all attempts:")
-                 details.append(f"  - Piper: (See primary issue above)")
+                 details.append("  - Piper: (See primary issue above)")
                  continue
             details.append(f"  - {source}: {str(error_info)}" if isinstance(error_info, Exception) else f"  - {source}: {error_info}")
         if not self.attempted_sources_summary: details.append("  No acquisition methods were attempted or configured successfully.")
         return "\n".join(details)
 
-class PiperClient:
+# Piper Link discovery results shared by every client in the process, so a second client does not
+# re-probe a link the first one just found (or found not running). link URL -> (monotonic time recorded, instanceId or None).
+# Readers apply their own window: DEFAULT_SHARED_DISCOVERY_TTL_SECONDS for an instanceId, their discovery_negative_ttl for a failure.
+_LINK_DISCOVERY_CACHE: Dict[str, Tuple[float, Optional[str]]] = {}
+_LINK_DISCOVERY_CACHE_LOCK = threading.Lock()
+
+_ClientT = TypeVar("_ClientT", bound="_PiperClientBase")
+
+class _PiperClientBase:
+    """
+    Configuration, caches, stored errors and the request/response handling shared by PiperClient
+    and AsyncPiperClient. Subclasses supply the transport and the network-facing methods.
+    """
     DEFAULT_PROJECT_ID: str = "444535882337"
     DEFAULT_REGION: str = "us-central1"
     DEFAULT_PIPER_GET_SCOPED_URL = f"https://getscopedgcpcredentials-{DEFAULT_PROJECT_ID}.{DEFAULT_REGION}.run.app"
@@ -116,6 +147,16 @@ class PiperClient:
     DEFAULT_PIPER_EXCHANGE_SECRET_URL = f"https://piper-exchange-sts-for-secret-{DEFAULT_PROJECT_ID}.{DEFAULT_REGION}.run.app"
     DEFAULT_PIPER_LINK_SERVICE_URL = "http://localhost:31477/piper-link-context"
     DEFAULT_PIPER_UI_BASE_URL = "https://agentpiper.com/secrets" 
+    DEFAULT_DISCOVERY_NEGATIVE_TTL_SECONDS: float = 5.0
+    DEFAULT_SHARED_DISCOVERY_TTL_SECONDS: float = 60.0 # How long other clients reuse a discovered instanceId
+    DEFAULT_MAX_RETRIES: int = 3
+    DEFAULT_RESOLVE_CACHE_TTL_SECONDS: float = 300.0
+    DEFAULT_STS_EXPIRY_BUFFER_SECONDS: float = 30.0 # A cached STS token is not handed out with less than this left
+    DEFAULT_GRANT_NEEDED_CACHE_TTL_SECONDS: float = 0.0 # Off: a retry right after the user grants access must reach Piper
+    # Per-client settings with_overrides() may change; everything else is shared with the original client.
+    OVERRIDABLE_SETTINGS: Tuple[str, ...] = ('use_piper', 'attempt_local_discovery', 'piper_link_instance_id', 'fallback_to_env', 'env_variable_prefix',
+                                             'env_variable_map', 'fallback_to_local_config', 'local_config_file_path', 'resolve_cache_ttl',
+                                             'grant_needed_cache_ttl', 'cache_sts_tokens', 'cache_raw_secrets', 'sts_expiry_buffer', 'discovery_negative_ttl')
     
     def __init__(self,
                  client_id: str,
@@ -125,7 +166,6 @@ class PiperClient:
                  resolve_mapping_url: Optional[str] = None,
                  exchange_secret_url: Optional[str] = None,
                  piper_link_service_url: Optional[str] = None,
-                 requests_session: Optional[requests.Session] = None,
                  piper_link_instance_id: Optional[str] = None, 
                  use_piper: bool = True,
                  attempt_local_discovery: bool = True,
@@ -134,7 +174,14 @@ class PiperClient:
                  env_variable_map: Optional[Dict[str, str]] = None,
                  fallback_to_local_config: bool = False,
                  local_config_file_path: Optional[str] = None,
-                 piper_ui_grant_page_url: Optional[str] = None 
+                 piper_ui_grant_page_url: Optional[str] = None,
+                 resolve_cache_ttl: float = DEFAULT_RESOLVE_CACHE_TTL_SECONDS,
+                 grant_needed_cache_ttl: float = DEFAULT_GRANT_NEEDED_CACHE_TTL_SECONDS,
+                 cache_sts_tokens: bool = True,
+                 cache_raw_secrets: bool = False,
+                 discovery_negative_ttl: float = DEFAULT_DISCOVERY_NEGATIVE_TTL_SECONDS,
+                 snapshot_env: bool = False,
+                 sts_expiry_buffer: float = DEFAULT_STS_EXPIRY_BUFFER_SECONDS
                 ):
         self._initialization_error: Optional[PiperConfigError] = None
         self.client_initialization_ok: bool = True
@@ -148,6 +195,7 @@ class PiperClient:
             self.client_id = "" 
         else:
             self.client_id: str = client_id
+        self._client_id_short: str = self.client_id[:8] # Logged with every Piper call; sliced once here
 
         effective_project_id = _piper_system_project_id or self.DEFAULT_PROJECT_ID
         effective_region = _piper_system_region or self.DEFAULT_REGION
@@ -176,16 +224,29 @@ class PiperClient:
             if self.piper_link_service_url != self.DEFAULT_PIPER_LINK_SERVICE_URL and not self.piper_link_service_url.startswith('http://localhost'):
                  logger.warning(f"Piper Link Service URL ('{self.piper_link_service_url}') is not the default localhost URL and does not start with http://localhost. This is unusual for local discovery.")
 
-        self._session = requests_session if requests_session else requests.Session()
         sdk_version = "0.7.0-dev" # Or "0.7.1-dev" if these are post-0.7.0
-        self._session.headers.update({'User-Agent': f'Pyper-SDK/{sdk_version}'})
+        self._user_agent: str = f'Pyper-SDK/{sdk_version}'
+        self._json_headers: Dict[str, str] = {'Content-Type': 'application/json'} # Static per client; shared by every Piper POST
         self._configured_instance_id: Optional[str] = piper_link_instance_id
         self._discovered_instance_id: Optional[str] = None 
+        self._discovery_failed_at: Optional[float] = None # time.monotonic() of the last failed discovery; retried once discovery_negative_ttl has passed
+        self.discovery_negative_ttl: float = discovery_negative_ttl # 0 retries discovery on every call
+        self.resolve_cache_ttl: float = resolve_cache_ttl # 0 disables the resolve cache
+        self.grant_needed_cache_ttl: float = grant_needed_cache_ttl # 0 disables remembering mapping_not_found
+        self.cache_sts_tokens: bool = cache_sts_tokens
+        self.cache_raw_secrets: bool = cache_raw_secrets
+        self.sts_expiry_buffer: float = sts_expiry_buffer # Cached STS results are dropped once less than this many seconds remain
+        self._sts_cache: Dict[Tuple[str, str, str], Tuple[Dict[str, Any], float]] = {} # (instance_id, normalized name, source) -> (secret_info, monotonic STS expiry)
+        self._var_to_cred: Dict[Tuple[str, str], Tuple[str, float]] = {} # (instance_id, normalized variable name) -> (credentialId, monotonic time stored); read against resolve_cache_ttl
+        self._grant_needed_at: Dict[Tuple[str, str], Tuple[float, Any]] = {} # Same key -> (monotonic time stored, error_details) of a recent mapping_not_found
+        self._resource_owner: Optional["_PiperClientBase"] = None # Set on clients derived via with_overrides(); resources are borrowed from it
         self.use_piper = use_piper
         self.attempt_local_discovery = attempt_local_discovery
         self.fallback_to_env = fallback_to_env
         self.env_variable_prefix = env_variable_prefix
         self.env_variable_map = env_variable_map if env_variable_map is not None else {}
+        self._env_name_cache: Dict[Tuple[str, str], str] = {} # (env_variable_prefix, variable name) -> derived env var name, for names not in env_variable_map
+        self._env_snapshot: Optional[Dict[str, str]] = dict(os.environ) if snapshot_env else None # When set, the env tier reads this instead of os.environ
         self.fallback_to_local_config = fallback_to_local_config
         self.local_config_file_path = os.path.expanduser(local_config_file_path) if local_config_file_path else None
         if self.client_initialization_ok and fallback_to_local_config and not self.local_config_file_path:
@@ -196,8 +257,8 @@ class PiperClient:
 
         if not self.client_initialization_ok and self._initialization_error:
             logger.error(f"PiperClient initialization FAILED. Error: {self._initialization_error}")
-        else:
-            log_msg_parts = [f"PiperClient initialized for agent client_id '{self.client_id[:8]}...' (SDK no longer handles client_secret)."]
+        elif logger.isEnabledFor(logging.INFO): # The summary is a dozen formatted strings; skip building it when INFO is off
+            log_msg_parts = [f"PiperClient initialized for agent client_id '{self._client_id_short}...' (SDK no longer handles client_secret)."]
             if not self.client_initialization_ok: 
                 log_msg_parts.insert(0, "[WARNING: Client initialized but client_initialization_ok is False without a specific error stored, check config]")
             log_msg_parts.append(f"Acquisition Strategy: Piper={'Enabled' if self.use_piper else 'Disabled'}")
@@ -218,218 +279,361 @@ class PiperClient:
             if self.piper_ui_grant_page_url: log_msg_parts.append(f"Piper UI grant page base: {self.piper_ui_grant_page_url}")
             logger.info(". ".join(log_msg_parts) + ".")
 
-    def discover_local_instance_id(self, force_refresh: bool = False) -> Optional[str]:
+    def _should_prewarm_discovery(self) -> bool:
+        return self.attempt_local_discovery and not self._configured_instance_id
+
+    def with_fallback(self: _ClientT,
+                      fallback_to_env: Optional[bool] = None,
+                      env_variable_prefix: Optional[str] = None,
+                      env_variable_map: Optional[Dict[str, str]] = None,
+                      fallback_to_local_config: Optional[bool] = None,
+                      local_config_file_path: Optional[str] = None) -> _ClientT:
+        """
+        Returns a client that differs from this one only in its env / local-config fallback
+        settings (arguments left as None keep this client's value). See with_overrides().
+        """
+        overrides = {"fallback_to_env": fallback_to_env, "env_variable_prefix": env_variable_prefix, "env_variable_map": env_variable_map,
+                     "fallback_to_local_config": fallback_to_local_config, "local_config_file_path": local_config_file_path}
+        return self.with_overrides(**{name: value for name, value in overrides.items() if value is not None})
+
+    def with_overrides(self: _ClientT, **overrides: Any) -> _ClientT:
+        """
+        Returns a client that differs from this one only in the given settings, which take the
+        same names and values as the constructor arguments listed in OVERRIDABLE_SETTINGS. It
+        shares this client's HTTP session, resolved credentialIds, cached STS tokens, discovered
+        instanceId and worker threads, so no extra connections or Piper Link discovery are needed.
+        Stored errors are not shared. The original keeps ownership of the shared resources:
+        close it, not the derived client.
+        """
+        unknown = sorted(set(overrides) - set(self.OVERRIDABLE_SETTINGS))
+        if unknown: raise PiperConfigError(f"with_overrides() cannot change {', '.join(unknown)}; allowed settings are: {', '.join(self.OVERRIDABLE_SETTINGS)}.")
+        derived = copy.copy(self)
+        derived._resource_owner = self._resource_owner or self
+        derived._last_get_secret_errors = {}
+        for name, value in overrides.items():
+            if name == "env_variable_map" and value is None: value = {}
+            elif name == "local_config_file_path" and value: value = os.path.expanduser(value)
+            setattr(derived, "_configured_instance_id" if name == "piper_link_instance_id" else name, value)
+        if derived.fallback_to_local_config and not derived.local_config_file_path:
+            raise PiperConfigError("If fallback_to_local_config is True, local_config_file_path must be provided.")
+        return derived
+
+    def refresh_env(self) -> None:
+        """
+        Re-reads os.environ into the snapshot used by the env tier. Only needed with snapshot_env=True; otherwise a no-op.
+        The snapshot is shared with clients from with_overrides() or with_fallback(), so they see the refresh too.
+        """
+        state = self._resource_owner or self
+        if state._env_snapshot is not None: state._env_snapshot = dict(os.environ)
+
+    def _discovery_state(self) -> "_PiperClientBase":
+        """The client holding discovery results. Derived clients share their owner's, but apply their own settings to it."""
+        return self._resource_owner or self
+
+    def _discovery_shortcut(self, force_refresh: bool) -> Tuple[bool, Optional[str]]:
+        """Returns (True, result) when discovery is answered by config or cache, (False, None) when Piper Link must be queried."""
+        state = self._discovery_state()
         if not self.client_initialization_ok:
             logger.warning("discover_local_instance_id called on a misconfigured client. Discovery will likely fail or be irrelevant.")
-            return None
+            return True, None
         if self._configured_instance_id:
-            logger.debug(f"Using instance_id explicitly provided at PiperClient init ('{self._configured_instance_id}'), skipping local discovery.")
-            return self._configured_instance_id
+            logger.debug("Using instance_id explicitly provided at PiperClient init ('%s'), skipping local discovery.", self._configured_instance_id)
+            return True, self._configured_instance_id
         if not self.use_piper or not self.attempt_local_discovery:
             logger.debug("Local discovery skipped: Piper usage or local discovery is disabled in client config.")
             self._discovered_instance_id = None
-            return None
-        if self._discovered_instance_id and not force_refresh:
-            logger.debug(f"Using cached discovered instanceId: {self._discovered_instance_id}")
-            return self._discovered_instance_id
-        logger.info(f"Attempting to discover Piper Link instanceId from: {self.piper_link_service_url}")
-        try:
-            response = self._session.get(self.piper_link_service_url, timeout=1.0)
-            response.raise_for_status()
-            data = response.json()
-            instance_id = data.get("instanceId")
-            if instance_id and isinstance(instance_id, str):
-                logger.info(f"Discovered and cached Piper Link instanceId: {instance_id}")
-                self._discovered_instance_id = instance_id; return instance_id
-            else: logger.warning(f"Local Piper Link service responded but instanceId was missing/invalid: {data}")
-        except requests.exceptions.ConnectionError: logger.warning(f"Local Piper Link service not found/running at {self.piper_link_service_url}.")
-        except requests.exceptions.Timeout: logger.warning(f"Timeout connecting to local Piper Link service at {self.piper_link_service_url}.")
-        except requests.exceptions.RequestException as e: logger.warning(f"Request error querying local Piper Link service at {self.piper_link_service_url}: {e}")
-        except json.JSONDecodeError as e: logger.warning(f"JSON decode error from local Piper Link service at {self.piper_link_service_url}: {e}")
-        except Exception as e: logger.error(f"Unexpected error querying local Piper Link service at {self.piper_link_service_url}: {e}", exc_info=True)
-        self._discovered_instance_id = None; return None
+            return True, None
+        if state._discovered_instance_id and not force_refresh:
+            logger.debug("Using cached discovered instanceId: %s", state._discovered_instance_id)
+            return True, state._discovered_instance_id
+        if not force_refresh and state._discovery_failed_at is not None and time.monotonic() < state._discovery_failed_at + self.discovery_negative_ttl:
+            logger.debug("Skipping local discovery: a recent attempt failed and the negative-cache window has not elapsed.")
+            return True, None
+        if not force_refresh:
+            shared = _LINK_DISCOVERY_CACHE.get(self.piper_link_service_url)
+            if shared is not None:
+                recorded_at, shared_instance_id = shared
+                valid_until = recorded_at + (self.DEFAULT_SHARED_DISCOVERY_TTL_SECONDS if shared_instance_id else self.discovery_negative_ttl)
+                if time.monotonic() < valid_until:
+                    logger.debug("Using Piper Link discovery result another client cached for %s: %s", self.piper_link_service_url, shared_instance_id)
+                    state._discovered_instance_id = shared_instance_id
+                    if shared_instance_id is None: state._discovery_failed_at = recorded_at
+                    return True, shared_instance_id
+        return False, None
 
-    def _get_instance_id_for_api_call(self, piper_link_instance_id_for_call: Optional[str]) -> Optional[str]:
-        if piper_link_instance_id_for_call:
-            logger.debug(f"Using instance_id passed directly to API call method: {piper_link_instance_id_for_call}")
-            return piper_link_instance_id_for_call
-        if self._configured_instance_id:
-            logger.debug(f"Using instance_id explicitly provided at PiperClient initialization: {self._configured_instance_id}")
-            return self._configured_instance_id
-        if self.attempt_local_discovery: 
-            return self.discover_local_instance_id()
-        logger.debug("No explicit instance_id provided, and local discovery is disabled.")
-        return self._discovered_instance_id 
+    def _record_discovery_result(self, instance_id: Optional[str]) -> Optional[str]:
+        recorded_at = time.monotonic()
+        state = self._discovery_state()
+        state._discovered_instance_id = instance_id
+        state._discovery_failed_at = recorded_at if instance_id is None else None
+        with _LINK_DISCOVERY_CACHE_LOCK:
+            _LINK_DISCOVERY_CACHE[self.piper_link_service_url] = (recorded_at, instance_id)
+        return instance_id
+
+    def _instance_id_from_link_context(self, data: Any) -> Optional[str]:
+        instance_id = data.get("instanceId")
+        if instance_id and isinstance(instance_id, str):
+            logger.info("Discovered and cached Piper Link instanceId: %s", instance_id)
+            return instance_id
+        logger.warning(f"Local Piper Link service responded but instanceId was missing/invalid: {data}")
+        return None
 
     def _normalize_variable_name(self, variable_name: str) -> str:
         if not variable_name: return ""
         s1 = re.sub(r'[-\s]+', '_', variable_name); s2 = re.sub(r'[^\w_]', '', s1)
         s3 = re.sub(r'_+', '_', s2); return s3.lower()
 
-    def _resolve_piper_variable(self, variable_name: str, instance_id_for_context: str) -> str:
-        normalized_name = self._normalize_variable_name(variable_name) 
+    @staticmethod
+    def _parse_api_error(response: Any, default_description_prefix: str = "API Error") -> Tuple[str, str, Any]:
+        """Returns (error_code, error_description, error_details) for a 4xx/5xx Piper API response."""
+        error_code = f'http_{response.status_code}'
+        error_description = f"{default_description_prefix} {response.status_code}"
+        try:
+            error_details: Any = _json_loads(response.content)
+        except ValueError:
+            error_details = response.text
+            return error_code, error_details or error_description, error_details
+        if isinstance(error_details, dict):
+            return (error_details.get('error', error_code),
+                    error_details.get('error_description', error_details.get('message', str(error_details))),
+                    error_details)
+        return error_code, str(error_details), error_details
+
+    @staticmethod
+    def _with_gcf_details(message: str, error_details: Any) -> str:
+        if not error_details: return message
+        try:
+            details_str = json.dumps(error_details)
+            if len(details_str) > 200: details_str = details_str[:200] + "..."
+            return message + f" (GCF Details: {details_str})"
+        except TypeError:
+            return message + f" (GCF Details: {str(error_details)[:200]})"
+
+    def _lookup_credential_id(self, variable_name: str, instance_id_for_context: str, use_cache: bool) -> Tuple[str, Optional[str]]:
+        """Returns (normalized variable name, cached credentialId or None). Raises ValueError for a name that normalizes to nothing."""
+        normalized_name = self._normalize_variable_name(variable_name)
         if not normalized_name: raise ValueError(f"Original variable name '{variable_name}' normalized to an empty/invalid string.")
+        if not use_cache: return normalized_name, None
+        cache_key = (instance_id_for_context, normalized_name)
+        cached_credential_id = self._cached_credential_id(cache_key)
+        if cached_credential_id is not None:
+            logger.debug("Using cached credentialId '%s' for var '%s', instance %s.", cached_credential_id, normalized_name, instance_id_for_context)
+            return normalized_name, cached_credential_id
+        grant_needed_entry = self._grant_needed_at.get(cache_key)
+        if grant_needed_entry is not None and self.grant_needed_cache_ttl > 0:
+            if time.monotonic() < grant_needed_entry[0] + self.grant_needed_cache_ttl:
+                logger.debug("Var '%s', instance %s had no grant mapping moments ago; not asking Piper again yet.", normalized_name, instance_id_for_context)
+                raise self._grant_needed_error(variable_name, normalized_name, grant_needed_entry[1])
+            self._grant_needed_at.pop(cache_key, None)
+        return normalized_name, None
+
+    def _cached_credential_id(self, cache_key: Tuple[str, str]) -> Optional[str]:
+        # Entries hold the time they were stored, so a derived client sharing this cache applies its own resolve_cache_ttl.
+        entry = self._var_to_cred.get(cache_key)
+        if entry is None or self.resolve_cache_ttl <= 0: return None
+        if time.monotonic() < entry[1] + self.resolve_cache_ttl: return entry[0]
+        self._var_to_cred.pop(cache_key, None)
+        return None
+
+    def _grant_needed_error(self, variable_name: str, normalized_name: str, error_details: Any) -> PiperGrantNeededError:
+        return PiperGrantNeededError(message=f"No active grant mapping found for variable '{normalized_name}' (original: '{variable_name}') for this user context.", status_code=404, error_code='mapping_not_found', error_details=error_details, agent_id_for_grant=self.client_id, variable_name_requested=variable_name, piper_ui_grant_url_template=self.piper_ui_grant_page_url)
+
+    def _resolve_payload(self, variable_name: str, normalized_name: str, instance_id_for_context: str) -> Dict[str, Any]:
+        logger.info("Calling (Piper) resolve_variable_mapping for var_for_lookup: '%s' (from original: '%s'), agent: '%s...', instance: %s", normalized_name, variable_name, self._client_id_short, instance_id_for_context)
+        return {'agentClientId': self.client_id, 'instanceId': instance_id_for_context, 'variableName': normalized_name}
+
+    def _handle_resolve_response(self, response: Any, variable_name: str, normalized_name: str, instance_id_for_context: str) -> str:
+        if 400 <= response.status_code < 600:
+            error_code_from_resp, error_description, error_details = self._parse_api_error(response)
+            logger.error("API error resolving mapping for var '%s', agent %s, instance %s. Status: %s, Code: %s, Details: %s", normalized_name, self._client_id_short, instance_id_for_context, response.status_code, error_code_from_resp, error_details)
+            if response.status_code == 404 and error_code_from_resp == 'mapping_not_found':
+                cache_key = (instance_id_for_context, normalized_name)
+                self._var_to_cred.pop(cache_key, None)
+                self._forget_piper_secrets(instance_id_for_context, normalized_name)
+                if self.grant_needed_cache_ttl > 0:
+                    self._grant_needed_at[cache_key] = (time.monotonic(), error_details)
+                raise self._grant_needed_error(variable_name, normalized_name, error_details)
+            if response.status_code == 401:
+                 raise PiperAuthError(f"Auth/context error resolving var mapping: {error_description}", status_code=response.status_code, error_code=error_code_from_resp, error_details=error_details)
+            if response.status_code == 403:
+                 raise PiperForbiddenError(f"Permission denied resolving var mapping: {error_description}", status_code=response.status_code, error_code=error_code_from_resp, error_details=error_details)
+            raise PiperError(self._with_gcf_details(f"Failed to resolve var mapping: {error_description}", error_details))
+        mapping_data = _json_loads(response.content); credential_id = mapping_data.get('credentialId')
+        if not credential_id or not isinstance(credential_id, str):
+            raise PiperError("Invalid response from resolve_variable_mapping (missing or invalid credentialId).")
+        logger.info("Piper resolved var '%s' (from original: '%s') to credentialId '%s'.", normalized_name, variable_name, credential_id)
+        cache_key = (instance_id_for_context, normalized_name)
+        self._grant_needed_at.pop(cache_key, None)
+        if self.resolve_cache_ttl > 0:
+            self._var_to_cred[cache_key] = (credential_id, time.monotonic())
+        return credential_id
+
+    def _forget_credential_id(self, variable_name: str, instance_id_for_context: str) -> None:
+        normalized_name = self._normalize_variable_name(variable_name)
+        self._var_to_cred.pop((instance_id_for_context, normalized_name), None)
+        self._forget_piper_secrets(instance_id_for_context, normalized_name)
+
+    def _forget_piper_secrets(self, instance_id_for_context: str, normalized_name: str) -> None:
+        for source in ("piper_sts", "piper_raw_secret"): self._sts_cache.pop((instance_id_for_context, normalized_name, source), None)
+
+    def _cached_piper_secret(self, variable_name: str, instance_id_for_context: str, fetch_raw_secret: bool) -> Optional[Dict[str, Any]]:
+        """Returns a copy of a still-valid earlier Piper result (with expires_in counting down), or None."""
+        if not self.cache_sts_tokens or (fetch_raw_secret and not self.cache_raw_secrets): return None
+        cache_key = (instance_id_for_context, self._normalize_variable_name(variable_name), "piper_raw_secret" if fetch_raw_secret else "piper_sts")
+        entry = self._sts_cache.get(cache_key)
+        if entry is None: return None
+        remaining = entry[1] - time.monotonic()
+        if remaining <= self.sts_expiry_buffer:
+            self._sts_cache.pop(cache_key, None)
+            return None
+        logger.debug("GET_SECRET '%s': Reusing cached %s result (%.0fs left), no Piper calls needed.", variable_name, entry[0]["source"], remaining)
+        secret_info = dict(entry[0])
+        secret_info["variable_name"] = variable_name
+        if secret_info.get("expires_in") is not None: secret_info["expires_in"] = int(remaining)
+        return secret_info
+
+    def _remember_piper_secret(self, piper_sts_response_data: Dict[str, Any], secret_info: Dict[str, Any]) -> Dict[str, Any]:
+        if not self.cache_sts_tokens or (secret_info["source"] == "piper_raw_secret" and not self.cache_raw_secrets): return secret_info
         try:
-            headers = {'Content-Type': 'application/json'}
-            payload = {'agentClientId': self.client_id, 'instanceId': instance_id_for_context, 'variableName': normalized_name}
-            logger.info(f"Calling (Piper) resolve_variable_mapping for var_for_lookup: '{normalized_name}' (from original: '{variable_name}'), agent: '{self.client_id[:8]}...', instance: {instance_id_for_context}")
-            response = self._session.post(self.resolve_mapping_url, headers=headers, json=payload, timeout=12)
-            if 400 <= response.status_code < 600:
-                error_details: Any = None; error_code_from_resp: str = f'http_{response.status_code}'; error_description: str = f"API Error {response.status_code}"
-                try:
-                    error_details = response.json(); error_code_from_resp = error_details.get('error', error_code_from_resp)
-                    error_description = error_details.get('error_description', error_details.get('message', str(error_details)))
-                except requests.exceptions.JSONDecodeError: error_details = response.text; error_description = error_details if error_details else error_description
-                logger.error(f"API error resolving mapping for var '{normalized_name}', agent {self.client_id[:8]}, instance {instance_id_for_context}. Status: {response.status_code}, Code: {error_code_from_resp}, Details: {error_details}")
-                if response.status_code == 404 and error_code_from_resp == 'mapping_not_found':
-                    raise PiperGrantNeededError(message=f"No active grant mapping found for variable '{normalized_name}' (original: '{variable_name}') for this user context.", status_code=404, error_code='mapping_not_found', error_details=error_details, agent_id_for_grant=self.client_id, variable_name_requested=variable_name, piper_ui_grant_url_template=self.piper_ui_grant_page_url)
-                if response.status_code == 401:
-                     raise PiperAuthError(f"Auth/context error resolving var mapping: {error_description}", status_code=response.status_code, error_code=error_code_from_resp, error_details=error_details)
-                if response.status_code == 403:
-                     raise PiperForbiddenError(f"Permission denied resolving var mapping: {error_description}", status_code=response.status_code, error_code=error_code_from_resp, error_details=error_details)
-                error_msg_with_details = f"Failed to resolve var mapping: {error_description}"
-                if error_details:
-                    try:
-                        details_str = json.dumps(error_details); 
-                        if len(details_str) > 200: details_str = details_str[:200] + "..."
-                        error_msg_with_details += f" (GCF Details: {details_str})"
-                    except TypeError: error_msg_with_details += f" (GCF Details: {str(error_details)[:200]})"
-                raise PiperError(error_msg_with_details)
-            mapping_data = response.json(); credential_id = mapping_data.get('credentialId')
-            if not credential_id or not isinstance(credential_id, str):
-                raise PiperError("Invalid response from resolve_variable_mapping (missing or invalid credentialId).")
-            logger.info(f"Piper resolved var '{normalized_name}' (from original: '{variable_name}') to credentialId '{credential_id}'.")
-            return credential_id
-        except (PiperGrantNeededError, PiperAuthError, PiperForbiddenError, ValueError): raise
-        except requests.exceptions.RequestException as e:
-            status_code = e.response.status_code if e.response is not None else None;
-            logger.error(f"Network error calling {self.resolve_mapping_url} for var '{normalized_name}'. Status: {status_code}", exc_info=True)
-            raise PiperError(f"Network error resolving variable: {e}") from e
-        except Exception as e:
-            logger.error(f"Unexpected error resolving variable '{normalized_name}': {e}", exc_info=True)
-            raise PiperError(f"Unexpected error resolving variable: {e}") from e
+            expires_in = float(piper_sts_response_data.get("expires_in"))  # type: ignore[arg-type]
+        except (TypeError, ValueError):
+            return secret_info # Lifetime unknown: do not guess
+        if expires_in > self.sts_expiry_buffer:
+            cache_key = (secret_info["piper_instance_id"], self._normalize_variable_name(secret_info["variable_name"]), secret_info["source"])
+            self._sts_cache[cache_key] = (dict(secret_info), time.monotonic() + expires_in)
+        return secret_info
 
-    def _fetch_piper_sts_token(self, credential_ids: List[str], instance_id_for_context: str) -> Dict[str, Any]:
+    def invalidate_resolve_cache(self, variable_name: Optional[str] = None) -> None:
+        """
+        Forgets cached variable -> credentialId mappings (and recent 'no grant' results),
+        for every Piper Link instance. With variable_name, only that variable is dropped;
+        without it the whole cache is cleared. Call after the user changes a grant in Piper
+        so the next get_secret() resolves it again instead of waiting for the cache TTL.
+        """
+        if variable_name is None:
+            self._var_to_cred.clear(); self._grant_needed_at.clear(); self._sts_cache.clear()
+            logger.debug("Cleared the resolve cache.")
+            return
+        if not isinstance(variable_name, str):
+            logger.warning("invalidate_resolve_cache called with non-string variable_name. No action.")
+            return
+        normalized_name = self._normalize_variable_name(variable_name.strip())
+        for cache in (self._var_to_cred, self._grant_needed_at, self._sts_cache): self._drop_cached_variable(cache, normalized_name)
+        logger.debug("Cleared resolve cache entries for var '%s'.", normalized_name)
+
+    @staticmethod
+    def _drop_cached_variable(cache: Dict[Any, Any], normalized_name: str) -> None:
+        for cache_key in [k for k in list(cache) if k[1] == normalized_name]: cache.pop(cache_key, None)
+
+    def _clean_credential_ids(self, credential_ids: List[str]) -> List[str]:
         if not credential_ids or not isinstance(credential_ids, list): raise ValueError("credential_ids must be a non-empty list.")
-        cleaned_credential_ids = [str(cid).strip() for cid in credential_ids if str(cid).strip()]
+        # Internal callers pass IDs straight from Piper responses; reuse such a list as-is (it is never mutated).
+        if all(type(cid) is str and cid and cid == cid.strip() for cid in credential_ids): return credential_ids
+        cleaned_credential_ids = [s for s in (str(cid).strip() for cid in credential_ids) if s]
         if not cleaned_credential_ids: raise ValueError("credential_ids list empty after cleaning.")
-        try:
-            headers = {'Content-Type': 'application/json'}
-            payload = {'agentClientId': self.client_id, 'instanceId': instance_id_for_context, 'credentialIds': cleaned_credential_ids}
-            logger.info(f"Calling (Piper) get_scoped_credentials for IDs: {cleaned_credential_ids}, agent: '{self.client_id[:8]}...', instance: {instance_id_for_context}")
-            response = self._session.post(self.get_scoped_url, headers=headers, json=payload, timeout=15)
-            if 400 <= response.status_code < 600:
-                error_details: Any = None; error_code_from_resp: str = f'http_{response.status_code}'; error_description: str = f"API Error {response.status_code}"
+        return cleaned_credential_ids
+
+    def _scoped_payload(self, cleaned_credential_ids: List[str], instance_id_for_context: str) -> Dict[str, Any]:
+        logger.info("Calling (Piper) get_scoped_credentials for IDs: %s, agent: '%s...', instance: %s", cleaned_credential_ids, self._client_id_short, instance_id_for_context)
+        return {'agentClientId': self.client_id, 'instanceId': instance_id_for_context, 'credentialIds': cleaned_credential_ids}
+
+    def _handle_scoped_response(self, response: Any, cleaned_credential_ids: List[str], instance_id_for_context: str) -> Dict[str, Any]:
+        if 400 <= response.status_code < 600:
+            error_code_from_resp, error_description, error_details = self._parse_api_error(response)
+            logger.error("API error getting scoped credentials agent %s, instance %s. Status: %s, Code: %s, Details: %s", self._client_id_short, instance_id_for_context, response.status_code, error_code_from_resp, error_details)
+            if response.status_code == 401:
+                 raise PiperAuthError(f"Auth/context error for scoped creds: {error_description}", status_code=401, error_code=error_code_from_resp or 'unauthorized', error_details=error_details)
+            if response.status_code == 403 or error_code_from_resp == 'permission_denied':
+                raise PiperForbiddenError(f"Permission denied for scoped creds: {error_description}", status_code=response.status_code or 403, error_code=error_code_from_resp or 'permission_denied', error_details=error_details)
+            raise PiperError(self._with_gcf_details(f"Failed to get scoped creds: {error_description}", error_details))
+        scoped_data = _json_loads(response.content)
+        if 'access_token' not in scoped_data or 'granted_credential_ids' not in scoped_data:
+            raise PiperError("Invalid response from get_scoped_credentials (missing access_token or granted_credential_ids).")
+        granted_credential_ids = scoped_data.get('granted_credential_ids') or []
+        if not granted_credential_ids:
+             logger.error("Piper returned no granted_credential_ids for instance %s (requested: %s). This implies no grant for any requested ID.", instance_id_for_context, cleaned_credential_ids)
+             raise PiperForbiddenError(f"Permission effectively denied for all requested credential_ids: {cleaned_credential_ids}. Check grants.", status_code=response.status_code or 403, error_code='permission_denied_for_all_ids', error_details=scoped_data)
+        # The backend normally echoes the requested IDs in order, so the list compare settles the common case without building sets.
+        if granted_credential_ids != cleaned_credential_ids and set(granted_credential_ids) != set(cleaned_credential_ids):
+            granted_set = set(granted_credential_ids)
+            if logger.isEnabledFor(logging.WARNING):
+                logger.warning("Partial success getting credentials for instance %s: Granted for %s, but not for %s.", instance_id_for_context, list(granted_set), [cid for cid in dict.fromkeys(cleaned_credential_ids) if cid not in granted_set])
+        logger.info("Piper successfully returned STS token for instance %s, granted IDs: %s", instance_id_for_context, scoped_data.get('granted_credential_ids'))
+        return scoped_data
+
+    def _link_needed_error(self, piper_link_instance_id_for_call: Optional[str]) -> PiperLinkNeededError:
+        missing_reason_parts = []
+        if piper_link_instance_id_for_call: missing_reason_parts.append("provided to get_secret()")
+        if self._configured_instance_id: missing_reason_parts.append("provided at PiperClient initialization")
+        if not missing_reason_parts and self.attempt_local_discovery: missing_reason_parts.append("discovered via Piper Link service (discovery may have failed or is disabled)")
+        elif not missing_reason_parts and not self.attempt_local_discovery: missing_reason_parts.append("no instance_id provided and local discovery is disabled")
+        return PiperLinkNeededError(f"Piper Link instanceId is required for Piper tier but was not ({' or '.join(missing_reason_parts) if missing_reason_parts else 'available'}).")
+
+    def _sts_secret_info(self, variable_name: str, piper_sts_response_data: Dict[str, Any], granted_piper_cred_id: str, effective_instance_id: str) -> Dict[str, Any]:
+        logger.info("GET_SECRET '%s': Successfully retrieved STS token from Piper.", variable_name)
+        return {"value": piper_sts_response_data.get("access_token"), "source": "piper_sts", "token_type": "Bearer", "expires_in": piper_sts_response_data.get("expires_in"), "piper_credential_id": granted_piper_cred_id, "piper_instance_id": effective_instance_id, "variable_name": variable_name}
+
+    def _exchange_payload(self, variable_name: str, granted_piper_cred_id: str, effective_instance_id: str) -> Dict[str, Any]:
+        logger.info("GET_SECRET '%s': STS token obtained, now attempting raw secret exchange from Piper.", variable_name)
+        if not self.exchange_secret_url: raise PiperConfigError("Raw secret fetch requested, but 'exchange_secret_url' is not configured.")
+        if not granted_piper_cred_id: raise PiperError("Internal SDK Error: piper_credential_id missing before raw exchange.")
+        exchange_payload = {"agentClientId": self.client_id, "instanceId": effective_instance_id, "piperCredentialId": granted_piper_cred_id}
+        logger.debug("SDK: Calling exchange_secret_url ('%s') for raw secret. Payload: %s", self.exchange_secret_url, exchange_payload)
+        return exchange_payload
+
+    def _raw_secret_info(self, variable_name: str, api_response: Any, granted_piper_cred_id: str, effective_instance_id: str) -> Dict[str, Any]:
+        if 400 <= api_response.status_code < 600:
+            err_code_exc, err_desc_exc, err_details_exc = self._parse_api_error(api_response, "Raw Secret Exchange GCF Error")
+            raise PiperRawSecretExchangeError(f"Failed to exchange STS for raw secret: {err_desc_exc}", status_code=api_response.status_code, error_code=err_code_exc, error_details=err_details_exc)
+        raw_secret_data = _json_loads(api_response.content); raw_secret_value = raw_secret_data.get('secret_value')
+        if raw_secret_value is None:
+            error_message_raw_missing = "Raw secret value key 'secret_value' missing or null in exchange GCF response."
+            if raw_secret_data:
                 try:
-                    error_details = response.json(); error_code_from_resp = error_details.get('error', error_code_from_resp)
-                    error_description = error_details.get('error_description', error_details.get('message', str(error_details)))
-                except requests.exceptions.JSONDecodeError: error_details = response.text; error_description = error_details if error_details else error_description
-                logger.error(f"API error getting scoped credentials agent {self.client_id[:8]}, instance {instance_id_for_context}. Status: {response.status_code}, Code: {error_code_from_resp}, Details: {error_details}")
-                if response.status_code == 401:
-                     raise PiperAuthError(f"Auth/context error for scoped creds: {error_description}", status_code=401, error_code=error_code_from_resp or 'unauthorized', error_details=error_details)
-                if response.status_code == 403 or error_code_from_resp == 'permission_denied': 
-                    raise PiperForbiddenError(f"Permission denied for scoped creds: {error_description}", status_code=response.status_code or 403, error_code=error_code_from_resp or 'permission_denied', error_details=error_details)
-                error_msg_with_details_sts = f"Failed to get scoped creds: {error_description}"
-                if error_details:
-                    try:
-                        details_str_sts = json.dumps(error_details)
-                        if len(details_str_sts) > 200: details_str_sts = details_str_sts[:200] + "..."
-                        error_msg_with_details_sts += f" (GCF Details: {details_str_sts})"
-                    except TypeError:
-                        error_msg_with_details_sts += f" (GCF Details: {str(error_details)[:200]})"
-                raise PiperError(error_msg_with_details_sts)
-            scoped_data = response.json()
-            if 'access_token' not in scoped_data or 'granted_credential_ids' not in scoped_data:
-                raise PiperError("Invalid response from get_scoped_credentials (missing access_token or granted_credential_ids).")
-            requested_set = set(cleaned_credential_ids); granted_set = set(scoped_data.get('granted_credential_ids', []))
-            if not granted_set: 
-                 logger.error(f"Piper returned no granted_credential_ids for instance {instance_id_for_context} (requested: {cleaned_credential_ids}). This implies no grant for any requested ID.")
-                 raise PiperForbiddenError(f"Permission effectively denied for all requested credential_ids: {cleaned_credential_ids}. Check grants.", status_code=response.status_code or 403, error_code='permission_denied_for_all_ids', error_details=scoped_data) 
-            if requested_set != granted_set: logger.warning(f"Partial success getting credentials for instance {instance_id_for_context}: Granted for {list(granted_set)}, but not for {list(requested_set - granted_set)}.")
-            logger.info(f"Piper successfully returned STS token for instance {instance_id_for_context}, granted IDs: {scoped_data.get('granted_credential_ids')}")
-            return scoped_data
-        except (PiperAuthError, PiperForbiddenError, ValueError): raise
-        except requests.exceptions.RequestException as e:
-            status_code = e.response.status_code if e.response is not None else None
-            logger.error(f"Network error calling {self.get_scoped_url}. Status: {status_code}", exc_info=True)
-            raise PiperError(f"Network error getting scoped creds: {e}") from e
-        except Exception as e:
-            logger.error(f"Unexpected error getting scoped creds: {e}", exc_info=True)
-            raise PiperError(f"Unexpected error getting scoped creds: {e}") from e
+                    details_str_raw = json.dumps(raw_secret_data)
+                    if len(details_str_raw) > 150: details_str_raw = details_str_raw[:150] + "..."
+                    error_message_raw_missing += f" (Response: {details_str_raw})"
+                except TypeError:
+                     error_message_raw_missing += f" (Response: {str(raw_secret_data)[:150]})"
+            raise PiperError(error_message_raw_missing)
+        logger.info("GET_SECRET '%s': Successfully retrieved raw secret from Piper.", variable_name)
+        return {"value": raw_secret_value, "source": "piper_raw_secret", "piper_credential_id": granted_piper_cred_id, "piper_instance_id": effective_instance_id, "variable_name": variable_name}
 
-    def _perform_get_secret(self, variable_name: str, piper_link_instance_id_for_call: Optional[str] = None, fetch_raw_secret: bool = False) -> Dict[str, Any]:
-        original_variable_name_for_error_reporting = variable_name 
-        attempted_sources_summary: Dict[str, Any] = {}
-        if self.use_piper:
-            logger.info(f"GET_SECRET '{original_variable_name_for_error_reporting}': Attempting Piper tier.")
-            effective_instance_id: Optional[str] = None; piper_tier_error: Optional[Exception] = None
-            try:
-                effective_instance_id = self._get_instance_id_for_api_call(piper_link_instance_id_for_call)
-                if not effective_instance_id:
-                    missing_reason_parts = []
-                    if piper_link_instance_id_for_call: missing_reason_parts.append("provided to get_secret()")
-                    if self._configured_instance_id: missing_reason_parts.append("provided at PiperClient initialization")
-                    if not missing_reason_parts and self.attempt_local_discovery: missing_reason_parts.append("discovered via Piper Link service (discovery may have failed or is disabled)")
-                    elif not missing_reason_parts and not self.attempt_local_discovery: missing_reason_parts.append("no instance_id provided and local discovery is disabled")
-                    link_needed_msg = f"Piper Link instanceId is required for Piper tier but was not ({' or '.join(missing_reason_parts) if missing_reason_parts else 'available'})."
-                    raise PiperLinkNeededError(link_needed_msg)
-                logger.debug(f"GET_SECRET '{original_variable_name_for_error_reporting}': Using instance_id '{effective_instance_id}' for Piper flow (Agent: {self.client_id[:8]}...).")
-                credential_id = self._resolve_piper_variable(original_variable_name_for_error_reporting, effective_instance_id) 
-                piper_sts_response_data = self._fetch_piper_sts_token([credential_id], effective_instance_id)
-                sts_token_value = piper_sts_response_data.get("access_token"); granted_piper_cred_id = piper_sts_response_data.get('granted_credential_ids', [credential_id])[0]
-                if not fetch_raw_secret:
-                    logger.info(f"GET_SECRET '{original_variable_name_for_error_reporting}': Successfully retrieved STS token from Piper.")
-                    return {"value": sts_token_value, "source": "piper_sts", "token_type": "Bearer", "expires_in": piper_sts_response_data.get("expires_in"), "piper_credential_id": granted_piper_cred_id, "piper_instance_id": effective_instance_id, "variable_name": original_variable_name_for_error_reporting}
-                else:
-                    logger.info(f"GET_SECRET '{original_variable_name_for_error_reporting}': STS token obtained, now attempting raw secret exchange from Piper.")
-                    if not self.exchange_secret_url: raise PiperConfigError("Raw secret fetch requested, but 'exchange_secret_url' is not configured.")
-                    if not granted_piper_cred_id: raise PiperError("Internal SDK Error: piper_credential_id missing before raw exchange.") 
-                    exchange_headers = {"Content-Type": "application/json"}
-                    exchange_payload = {"agentClientId": self.client_id, "instanceId": effective_instance_id, "piperCredentialId": granted_piper_cred_id}
-                    logger.debug(f"SDK: Calling exchange_secret_url ('{self.exchange_secret_url}') for raw secret. Payload: {exchange_payload}")
-                    api_response = self._session.post(self.exchange_secret_url, headers=exchange_headers, json=exchange_payload, timeout=10)
-                    if 400 <= api_response.status_code < 600:
-                        err_details_exc: Any = None; err_code_exc: str = f'http_{api_response.status_code}'; err_desc_exc: str = f"Raw Secret Exchange GCF Error {api_response.status_code}"
-                        try:
-                            err_details_exc = api_response.json(); err_code_exc = err_details_exc.get('error', err_code_exc); err_desc_exc = err_details_exc.get('error_description', err_details_exc.get('message', str(err_details_exc)))
-                        except requests.exceptions.JSONDecodeError: err_details_exc = api_response.text; err_desc_exc = err_details_exc if err_details_exc else err_desc_exc
-                        raise PiperRawSecretExchangeError(f"Failed to exchange STS for raw secret: {err_desc_exc}", status_code=api_response.status_code, error_code=err_code_exc, error_details=err_details_exc)
-                    raw_secret_data = api_response.json(); raw_secret_value = raw_secret_data.get('secret_value')
-                    if raw_secret_value is None:
-                        error_message_raw_missing = "Raw secret value key 'secret_value' missing or null in exchange GCF response."
-                        if raw_secret_data:
-                            try:
-                                details_str_raw = json.dumps(raw_secret_data)
-                                if len(details_str_raw) > 150: details_str_raw = details_str_raw[:150] + "..."
-                                error_message_raw_missing += f" (Response: {details_str_raw})"
-                            except TypeError:
-                                 error_message_raw_missing += f" (Response: {str(raw_secret_data)[:150]})"
-                        raise PiperError(error_message_raw_missing)
-                    logger.info(f"GET_SECRET '{original_variable_name_for_error_reporting}': Successfully retrieved raw secret from Piper.")
-                    return {"value": raw_secret_value, "source": "piper_raw_secret", "piper_credential_id": granted_piper_cred_id, "piper_instance_id": effective_instance_id, "variable_name": original_variable_name_for_error_reporting}
-            except (PiperLinkNeededError, PiperGrantNeededError, PiperForbiddenError, PiperAuthError, PiperRawSecretExchangeError, PiperConfigError, PiperError) as e:
-                piper_tier_error = e; logger.warning(f"GET_SECRET '{original_variable_name_for_error_reporting}': Piper tier failed: {type(e).__name__} - {str(e).splitlines()[0]}")
-            except Exception as e:
-                error_message = f"Unexpected error during Piper tier operation for '{original_variable_name_for_error_reporting}': {type(e).__name__} - {str(e)}"
-                piper_tier_error = PiperError(error_message)
-                logger.error(f"GET_SECRET '{original_variable_name_for_error_reporting}': Unexpected error in Piper tier: {error_message}", exc_info=True) 
-            if piper_tier_error: attempted_sources_summary["Piper"] = piper_tier_error
+    def _piper_tier_failure(self, variable_name: str, e: Exception) -> PiperError:
+        if isinstance(e, PiperError):
+            if logger.isEnabledFor(logging.WARNING):
+                logger.warning("GET_SECRET '%s': Piper tier failed: %s - %s", variable_name, type(e).__name__, str(e).splitlines()[0])
+            return e
+        error_message = f"Unexpected error during Piper tier operation for '{variable_name}': {type(e).__name__} - {str(e)}"
+        logger.error(f"GET_SECRET '{variable_name}': Unexpected error in Piper tier: {error_message}", exc_info=True)
+        return PiperError(error_message)
+
+    def _resolve_env_fallback_name(self, variable_name: str) -> str:
+        """Returns the env var checked for variable_name: its env_variable_map entry, else the prefixed, upper-cased name (memoized)."""
+        if self.env_variable_map and variable_name in self.env_variable_map: return self.env_variable_map[variable_name]
+        cache_key = (self.env_variable_prefix, variable_name) # Keyed on the prefix too, so reassigning env_variable_prefix never returns stale names
+        env_var_name = self._env_name_cache.get(cache_key)
+        if env_var_name is None:
+            normalized_for_env = re.sub(r'_+', '_', re.sub(r'[^A-Z0-9_]', '_', variable_name.upper()))
+            env_var_name = self._env_name_cache[cache_key] = f"{self.env_variable_prefix}{normalized_for_env}"
+        return env_var_name
+
+    def _perform_fallback_tiers(self, variable_name: str, attempted_sources_summary: Dict[str, Any]) -> Dict[str, Any]:
+        original_variable_name_for_error_reporting = variable_name
         if self.fallback_to_env and (not self.use_piper or attempted_sources_summary.get("Piper") is not None):
-            logger.info(f"GET_SECRET '{original_variable_name_for_error_reporting}': Attempting Environment Variable tier.")
-            env_var_to_check: Optional[str] = None
-            if self.env_variable_map and original_variable_name_for_error_reporting in self.env_variable_map: env_var_to_check = self.env_variable_map[original_variable_name_for_error_reporting]
-            else: 
-                normalized_for_env = original_variable_name_for_error_reporting.upper(); normalized_for_env = re.sub(r'[^A-Z0-9_]', '_', normalized_for_env); normalized_for_env = re.sub(r'_+', '_', normalized_for_env); env_var_to_check = f"{self.env_variable_prefix}{normalized_for_env}"
-            secret_value_from_env = os.environ.get(env_var_to_check)
+            logger.info("GET_SECRET '%s': Attempting Environment Variable tier.", original_variable_name_for_error_reporting)
+            env_var_to_check = self._resolve_env_fallback_name(original_variable_name_for_error_reporting)
+            env_snapshot = (self._resource_owner or self)._env_snapshot # Owned by the original client, so refresh_env() reaches derived clients
+            secret_value_from_env = (os.environ if env_snapshot is None else env_snapshot).get(env_var_to_check)
             if secret_value_from_env is not None:
-                logger.info(f"GET_SECRET '{original_variable_name_for_error_reporting}': Successfully retrieved from env var '{env_var_to_check}'.")
+                logger.info("GET_SECRET '%s': Successfully retrieved from env var '%s'.", original_variable_name_for_error_reporting, env_var_to_check)
                 return {"value": secret_value_from_env, "source": "environment_variable", "env_var_name_used": env_var_to_check, "token_type": "DirectValue", "expires_in": None, "variable_name": original_variable_name_for_error_reporting}
-            else: 
-                failure_msg = f"Environment variable '{env_var_to_check}' not set."; attempted_sources_summary["EnvironmentVariable"] = failure_msg; logger.info(f"GET_SECRET '{original_variable_name_for_error_reporting}': Env tier failed: {failure_msg}")
+            else:
+                failure_msg = f"Environment variable '{env_var_to_check}' not set."; attempted_sources_summary["EnvironmentVariable"] = failure_msg; logger.info("GET_SECRET '%s': Env tier failed: %s", original_variable_name_for_error_reporting, failure_msg)
         if self.fallback_to_local_config and self.local_config_file_path and \
            (not self.use_piper or attempted_sources_summary.get("Piper") is not None) and \
            (not self.fallback_to_env or attempted_sources_summary.get("EnvironmentVariable") is not None):
-            logger.info(f"GET_SECRET '{original_variable_name_for_error_reporting}': Attempting Local Config File tier (Path: '{self.local_config_file_path}').")
+            logger.info("GET_SECRET '%s': Attempting Local Config File tier (Path: '%s').", original_variable_name_for_error_reporting, self.local_config_file_path)
             local_config_tier_error: Optional[Any] = None; source_key_local_config = f"LocalConfigFile ({self.local_config_file_path})"
             try:
                 if not os.path.exists(self.local_config_file_path): raise FileNotFoundError(f"File not found: {self.local_config_file_path}")
@@ -437,7 +641,7 @@ class PiperClient:
                 with open(self.local_config_file_path, 'r') as f: config_data = json.load(f)
                 if original_variable_name_for_error_reporting in config_data:
                     secret_value_from_config = config_data[original_variable_name_for_error_reporting]
-                    logger.info(f"GET_SECRET '{original_variable_name_for_error_reporting}': Successfully retrieved from local config file.")
+                    logger.info("GET_SECRET '%s': Successfully retrieved from local config file.", original_variable_name_for_error_reporting)
                     return {"value": secret_value_from_config, "source": "local_config_file", "config_file_path": self.local_config_file_path, "token_type": "DirectValue", "expires_in": None, "variable_name": original_variable_name_for_error_reporting}
                 else: 
                     local_config_tier_error = f"Variable '{original_variable_name_for_error_reporting}' not found in the config file."
@@ -447,31 +651,39 @@ class PiperClient:
             except Exception as e_local_cfg: local_config_tier_error = PiperError(f"Unexpected error reading local config file '{self.local_config_file_path}': {e_local_cfg}")
             if local_config_tier_error: 
                 attempted_sources_summary[source_key_local_config] = local_config_tier_error
-                logger.warning(f"GET_SECRET '{original_variable_name_for_error_reporting}': Local Config tier failed: {str(local_config_tier_error).splitlines()[0]}")
+                if logger.isEnabledFor(logging.WARNING):
+                    logger.warning("GET_SECRET '%s': Local Config tier failed: %s", original_variable_name_for_error_reporting, str(local_config_tier_error).splitlines()[0])
         if not attempted_sources_summary: 
             logger.error(f"GET_SECRET '{original_variable_name_for_error_reporting}': No acquisition tiers were successfully run or configured to attempt."); 
             attempted_sources_summary["SDKInternal"] = "No acquisition methods were enabled or attempted due to client configuration."
         final_error_message = f"Failed to acquire secret for '{original_variable_name_for_error_reporting}'."
-        logger.error(f"GET_SECRET '{original_variable_name_for_error_reporting}': All configured tiers failed. Raising PiperSecretAcquisitionError. Summary: {attempted_sources_summary}")
+        logger.error("GET_SECRET '%s': All configured tiers failed. Raising PiperSecretAcquisitionError. Summary: %s", original_variable_name_for_error_reporting, attempted_sources_summary)
         raise PiperSecretAcquisitionError(message=final_error_message, variable_name=original_variable_name_for_error_reporting, attempted_sources_summary=attempted_sources_summary)
 
-    def get_secret(self, variable_name: str, piper_link_instance_id_for_call: Optional[str] = None, fetch_raw_secret: bool = False, raise_on_failure: bool = True) -> Optional[Dict[str, Any]]:
-        _error_key_for_this_call: Optional[str] = None 
+    @staticmethod
+    def _check_get_secrets_argument(variable_names: Any) -> List[str]:
+        if not variable_names or not isinstance(variable_names, (list, tuple)) or not all(isinstance(name, str) for name in variable_names):
+            raise PiperConfigError("variable_names must be a non-empty list of strings for get_secrets.")
+        return list(dict.fromkeys(variable_names))
+
+    def _check_get_secret_call(self, variable_name: Any, raise_on_failure: bool) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """Validates get_secret() input and client state. Returns (error key, None) to proceed, or (error key, failure dict)."""
+        _error_key_for_this_call: str
         if not isinstance(variable_name, str):
             err = PiperConfigError("variable_name must be a string, not None or other type.")
-            _error_key_for_this_call = "INPUT_VALIDATION_NON_STRING_VAR_NAME" 
+            _error_key_for_this_call = "INPUT_VALIDATION_NON_STRING_VAR_NAME"
             self._last_get_secret_errors[_error_key_for_this_call] = err
             if raise_on_failure: raise err
-            return {"value": None, "source": "config_error_input_type", "variable_name": _error_key_for_this_call, "error_object": err }
+            return _error_key_for_this_call, {"value": None, "source": "config_error_input_type", "variable_name": _error_key_for_this_call, "error_object": err }
 
         original_variable_name_stripped = variable_name.strip()
         if not original_variable_name_stripped:
             err = PiperConfigError("variable_name cannot be empty or all whitespace after stripping.")
-            _error_key_for_this_call = original_variable_name_stripped 
-            self._last_get_secret_errors[_error_key_for_this_call] = err 
+            _error_key_for_this_call = original_variable_name_stripped
+            self._last_get_secret_errors[_error_key_for_this_call] = err
             if raise_on_failure: raise err
-            return {"value": None, "source": "config_error_input_empty", "variable_name": _error_key_for_this_call, "error_object": err}
-        
+            return _error_key_for_this_call, {"value": None, "source": "config_error_input_empty", "variable_name": _error_key_for_this_call, "error_object": err}
+
         error_key_for_storage = original_variable_name_stripped
 
         if not self.client_initialization_ok:
@@ -482,32 +694,29 @@ class PiperClient:
                 raise init_fail_error
             else:
                 logger.warning(f"GET_SECRET '{error_key_for_storage}': Aborted due to client initialization failure. Storing error and returning failure dict.")
-                return {"value": None, "source": "client_initialization_failure", "variable_name": error_key_for_storage, "error_object": init_fail_error}
-        try:
-            secret_info = self._perform_get_secret(error_key_for_storage, piper_link_instance_id_for_call, fetch_raw_secret)
-            if error_key_for_storage in self._last_get_secret_errors:
-                del self._last_get_secret_errors[error_key_for_storage]
-            return secret_info
-        except PiperError as e: 
+                return error_key_for_storage, {"value": None, "source": "client_initialization_failure", "variable_name": error_key_for_storage, "error_object": init_fail_error}
+        return error_key_for_storage, None
+
+    def _get_secret_failed(self, error_key_for_storage: str, e: Exception, raise_on_failure: bool) -> Dict[str, Any]:
+        if isinstance(e, PiperError):
             self._last_get_secret_errors[error_key_for_storage] = e
-            if raise_on_failure: raise 
-            else:
-                logger.warning(f"GET_SECRET '{error_key_for_storage}': Acquisition failed. Storing error and returning failure dict as raise_on_failure=False. Error: {type(e).__name__} - {str(e).splitlines()[0]}")
-                failure_source = "acquisition_failure" 
-                if isinstance(e, PiperSecretAcquisitionError):
-                    piper_tier_issue = e.attempted_sources_summary.get("Piper")
-                    if isinstance(piper_tier_issue, PiperGrantNeededError): failure_source = "piper_grant_needed"
-                    elif isinstance(piper_tier_issue, PiperLinkNeededError): failure_source = "piper_link_needed"
-                elif isinstance(e, PiperGrantNeededError): failure_source = "piper_grant_needed"
-                elif isinstance(e, PiperLinkNeededError): failure_source = "piper_link_needed"
-                elif isinstance(e, PiperConfigError): failure_source = "config_error_runtime" 
-                return {"value": None, "source": failure_source, "variable_name": error_key_for_storage, "error_object": e}
-        except Exception as e_unhandled: 
-            wrapped_error = PiperError(f"Unexpected unhandled error during get_secret for '{error_key_for_storage}': {e_unhandled}")
-            logger.error(f"GET_SECRET '{error_key_for_storage}': Unexpected unhandled error. Wrapping and processing. Original: {type(e_unhandled).__name__} - {e_unhandled}", exc_info=True)
-            self._last_get_secret_errors[error_key_for_storage] = wrapped_error
-            if raise_on_failure: raise wrapped_error
-            else: return {"value": None, "source": "unexpected_sdk_error", "variable_name": error_key_for_storage, "error_object": wrapped_error}
+            if raise_on_failure: raise e
+            if logger.isEnabledFor(logging.WARNING):
+                logger.warning("GET_SECRET '%s': Acquisition failed. Storing error and returning failure dict as raise_on_failure=False. Error: %s - %s", error_key_for_storage, type(e).__name__, str(e).splitlines()[0])
+            failure_source = "acquisition_failure"
+            if isinstance(e, PiperSecretAcquisitionError):
+                piper_tier_issue = e.attempted_sources_summary.get("Piper")
+                if isinstance(piper_tier_issue, PiperGrantNeededError): failure_source = "piper_grant_needed"
+                elif isinstance(piper_tier_issue, PiperLinkNeededError): failure_source = "piper_link_needed"
+            elif isinstance(e, PiperGrantNeededError): failure_source = "piper_grant_needed"
+            elif isinstance(e, PiperLinkNeededError): failure_source = "piper_link_needed"
+            elif isinstance(e, PiperConfigError): failure_source = "config_error_runtime"
+            return {"value": None, "source": failure_source, "variable_name": error_key_for_storage, "error_object": e}
+        wrapped_error = PiperError(f"Unexpected unhandled error during get_secret for '{error_key_for_storage}': {e}")
+        logger.error(f"GET_SECRET '{error_key_for_storage}': Unexpected unhandled error. Wrapping and processing. Original: {type(e).__name__} - {e}", exc_info=True)
+        self._last_get_secret_errors[error_key_for_storage] = wrapped_error
+        if raise_on_failure: raise wrapped_error from e
+        return {"value": None, "source": "unexpected_sdk_error", "variable_name": error_key_for_storage, "error_object": wrapped_error}
 
     def clear_cached_instance_id(self) -> None:
         """
@@ -515,10 +724,16 @@ class PiperClient:
         This forces a fresh discovery attempt by discover_local_instance_id() 
         on its next call (if local discovery is enabled and no instanceId is configured).
         Useful if Piper Link might have been restarted or the user session changed.
+        Also forgets a recent discovery failure, and any result shared by other clients
+        for the same Piper Link URL, so the next call retries immediately.
         """
-        if self._discovered_instance_id is not None:
-            logger.debug(f"Clearing cached discovered instanceId ('{self._discovered_instance_id}').")
-            self._discovered_instance_id = None
+        state = self._discovery_state()
+        state._discovery_failed_at = None
+        with _LINK_DISCOVERY_CACHE_LOCK:
+            _LINK_DISCOVERY_CACHE.pop(self.piper_link_service_url, None)
+        if state._discovered_instance_id is not None:
+            logger.debug("Clearing cached discovered instanceId ('%s').", state._discovered_instance_id)
+            state._discovered_instance_id = None
         else:
             logger.debug("No cached discovered instanceId to clear.")
 
@@ -526,7 +741,8 @@ class PiperClient:
         """
         Clears any internally stored error associated with the given variable_name
         that might have been set by a previous call to get_secret(raise_on_failure=False)
-        or by is_grant_still_active().
+        or by is_grant_still_active(). Also forgets a 'no grant' result remembered
+        for the variable under grant_needed_cache_ttl, so the next attempt asks Piper again.
         """
         if not isinstance(variable_name, str):
             logger.warning("clear_last_error_for_variable called with non-string variable_name. No action.")
@@ -542,64 +758,52 @@ class PiperClient:
             # If the original input was, say, None, get_secret would have used INPUT_VALIDATION_NON_STRING_VAR_NAME.
             # This method expects the original user-facing variable_name or the special key.
         
-        if key_to_clear in self._last_get_secret_errors:
-            del self._last_get_secret_errors[key_to_clear]
-            logger.debug(f"Cleared stored error for SDK error key '{key_to_clear}' (derived from input '{variable_name}').")
+        if self._grant_needed_at: self._drop_cached_variable(self._grant_needed_at, self._normalize_variable_name(key_to_clear))
+        if self._last_get_secret_errors.pop(key_to_clear, None) is not None:
+            logger.debug("Cleared stored error for SDK error key '%s' (derived from input '%s').", key_to_clear, variable_name)
         else:
-            logger.debug(f"No stored error found for SDK error key '{key_to_clear}' (derived from input '{variable_name}') to clear.")
+            logger.debug("No stored error found for SDK error key '%s' (derived from input '%s') to clear.", key_to_clear, variable_name)
 
-    def is_grant_still_active(self, variable_name: str, 
-                                piper_link_instance_id_for_call: Optional[str] = None,
-                                store_error_if_inactive: bool = True) -> bool:
-        logger.debug(f"is_grant_still_active called for variable: '{variable_name}'")
+    def _check_grant_check_call(self, variable_name: Any, store_error_if_inactive: bool) -> Optional[str]:
+        """Validates is_grant_still_active() input. Returns the error key, or None when Piper is disabled (grant treated as active)."""
+        logger.debug("is_grant_still_active called for variable: '%s'", variable_name)
         if not self.client_initialization_ok:
             err_msg = "is_grant_still_active: PiperClient is not properly initialized."
             logger.error(err_msg)
             raise self._initialization_error or PiperConfigError(err_msg)
         if not self.use_piper:
             logger.debug("is_grant_still_active: Piper usage is disabled. Assuming grant 'active' or handled by non-Piper means.")
-            return True 
+            return None
         if not isinstance(variable_name, str) :
             err = PiperConfigError("is_grant_still_active: variable_name must be a string.")
             if store_error_if_inactive: self._last_get_secret_errors["INPUT_VALIDATION_NON_STRING_VAR_NAME"] = err # Use consistent key
-            raise err 
+            raise err
         original_variable_name_stripped = variable_name.strip()
         if not original_variable_name_stripped:
             err = PiperConfigError("is_grant_still_active: variable_name cannot be empty or all whitespace after stripping.")
             if store_error_if_inactive: self._last_get_secret_errors[original_variable_name_stripped] = err # Key is ""
             raise err
-        
-        error_key_for_storage = original_variable_name_stripped
-        effective_instance_id: Optional[str] = None
-        try:
-            effective_instance_id = self._get_instance_id_for_api_call(piper_link_instance_id_for_call)
-            if not effective_instance_id:
-                link_error = PiperLinkNeededError("Instance ID required for grant check, but not available (discovery disabled or failed, and none provided).")
-                if store_error_if_inactive: self._last_get_secret_errors[error_key_for_storage] = link_error
-                raise link_error 
-        except PiperLinkNeededError as e_link_direct: 
-            if store_error_if_inactive: self._last_get_secret_errors[error_key_for_storage] = e_link_direct
-            raise 
-        try:
-            credential_id = self._resolve_piper_variable(original_variable_name_stripped, effective_instance_id)
-            logger.info(f"is_grant_still_active for '{original_variable_name_stripped}': Grant is ACTIVE (resolved to cred_id: {credential_id}).")
-            if error_key_for_storage in self._last_get_secret_errors: del self._last_get_secret_errors[error_key_for_storage]
-            return True
-        except PiperGrantNeededError as e_grant:
-            logger.info(f"is_grant_still_active for '{original_variable_name_stripped}': Grant is NOT active (mapping_not_found).")
-            if store_error_if_inactive: self._last_get_secret_errors[error_key_for_storage] = e_grant
-            return False
-        except (PiperAuthError, PiperForbiddenError, PiperError) as e_api:
-            logger.error(f"is_grant_still_active for '{original_variable_name_stripped}': API error during grant check: {type(e_api).__name__} - {e_api}")
-            if store_error_if_inactive: self._last_get_secret_errors[error_key_for_storage] = e_api
-            return False 
-        except ValueError as e_val: 
-             logger.error(f"is_grant_still_active for '{original_variable_name_stripped}': Value error during grant check: {e_val}")
-             err_obj = PiperConfigError(f"Invalid variable name for grant check: {e_val}")
-             if store_error_if_inactive: self._last_get_secret_errors[error_key_for_storage] = err_obj
-             # Re-raise as PiperConfigError to be consistent with other input validation
-             raise err_obj from e_val
+        return original_variable_name_stripped
 
+    def _grant_check_passed(self, error_key_for_storage: str, credential_id: str) -> bool:
+        logger.info("is_grant_still_active for '%s': Grant is ACTIVE (resolved to cred_id: %s).", error_key_for_storage, credential_id)
+        self._last_get_secret_errors.pop(error_key_for_storage, None)
+        return True
+
+    def _grant_check_failed(self, error_key_for_storage: str, e: Exception, store_error_if_inactive: bool) -> bool:
+        if isinstance(e, PiperGrantNeededError):
+            logger.info("is_grant_still_active for '%s': Grant is NOT active (mapping_not_found).", error_key_for_storage)
+            if store_error_if_inactive: self._last_get_secret_errors[error_key_for_storage] = e
+            return False
+        if isinstance(e, PiperError):
+            logger.error(f"is_grant_still_active for '{error_key_for_storage}': API error during grant check: {type(e).__name__} - {e}")
+            if store_error_if_inactive: self._last_get_secret_errors[error_key_for_storage] = e
+            return False
+        logger.error(f"is_grant_still_active for '{error_key_for_storage}': Value error during grant check: {e}")
+        err_obj = PiperConfigError(f"Invalid variable name for grant check: {e}")
+        if store_error_if_inactive: self._last_get_secret_errors[error_key_for_storage] = err_obj
+        # Re-raise as PiperConfigError to be consistent with other input validation
+        raise err_obj from e
 
     def get_last_error_for_variable(self, variable_name: str) -> Optional[PiperError]:
         if not isinstance(variable_name, str):
@@ -623,16 +827,16 @@ class PiperClient:
             display_variable_name = "the provided variable name (all whitespace)"
         elif variable_name == "": 
              display_variable_name = "the provided variable name (empty string)"
-        elif error_object and hasattr(error_object, 'variable_name') and getattr(error_object, 'variable_name'):
-            display_variable_name = getattr(error_object, 'variable_name')
+        elif error_object and getattr(error_object, 'variable_name', None):
+            display_variable_name = error_object.variable_name # type: ignore[attr-defined]
         else:
             display_variable_name = "the requested secret"
 
         if error_object is not None:
             if isinstance(error_object, PiperError):
                 error_to_diagnose = error_object
-                if hasattr(error_object, 'variable_name') and getattr(error_object, 'variable_name'):
-                    display_variable_name = getattr(error_object, 'variable_name')
+                error_variable_name = getattr(error_object, 'variable_name', None)
+                if error_variable_name: display_variable_name = error_variable_name
             else:
                 logger.warning(f"get_resolution_advice called with non-PiperError error_object type: {type(error_object)}. Ignoring it.")
         
@@ -644,13 +848,13 @@ class PiperClient:
             display_variable_name = "Piper SDK client configuration" 
 
         if error_to_diagnose is None:
-            logger.debug(f"get_resolution_advice: No relevant error found for '{variable_name}'. No advice to generate.")
+            logger.debug("get_resolution_advice: No relevant error found for '%s'. No advice to generate.", variable_name)
             return None
 
         if error_to_diagnose == self._initialization_error:
-            advice_parts.append(f"Piper SDK Client Initial Setup Problem:")
+            advice_parts.append("Piper SDK Client Initial Setup Problem:")
         elif isinstance(error_to_diagnose, PiperConfigError) and (display_variable_name == "Piper SDK client configuration" or "input variable name" in display_variable_name):
-            advice_parts.append(f"There's a problem with the input or client configuration:")
+            advice_parts.append("There's a problem with the input or client configuration:")
         else:
             advice_parts.append(f"I need help with the configuration for: '{display_variable_name}'.")
 
@@ -668,15 +872,16 @@ class PiperClient:
                     advice_parts.append(f"    Please use the Piper application or interface to grant access for client ID '{piper_tier_failure.agent_id_for_grant}' to variable '{piper_tier_failure.variable_name_requested}'.")
                 actionable_advice_generated = True
             elif isinstance(piper_tier_failure, PiperLinkNeededError):
-                advice_parts.append(f"  - ACTION REQUIRED (Piper System): The Piper Link application needs to be connected.")
-                advice_parts.append(f"    Please ensure Piper Link is running on your computer and you are logged in.")
+                advice_parts.append("  - ACTION REQUIRED (Piper System): The Piper Link application needs to be connected.")
+                advice_parts.append("    Please ensure Piper Link is running on your computer and you are logged in.")
                 if self.attempt_local_discovery and self.piper_link_service_url:
                      advice_parts.append(f"    (The SDK tried to find it at: {self.piper_link_service_url})")
                 actionable_advice_generated = True
             elif isinstance(piper_tier_failure, PiperError): 
                 advice_parts.append(f"  - Piper System Issue: {str(piper_tier_failure).splitlines()[0]}")
-                if hasattr(piper_tier_failure, 'error_details') and getattr(piper_tier_failure, 'error_details'):
-                    details_preview = str(getattr(piper_tier_failure, 'error_details')); 
+                error_details = getattr(piper_tier_failure, 'error_details', None)
+                if error_details:
+                    details_preview = str(error_details)
                     if len(details_preview) > 100: details_preview = details_preview[:97] + "..."
                     advice_parts.append(f"    Details: {details_preview}")
             env_fail_msg = summary.get("EnvironmentVariable")
@@ -686,7 +891,7 @@ class PiperClient:
             local_config_key_prefix = "LocalConfigFile ("; local_config_fail_key = next((k for k in summary if k.startswith(local_config_key_prefix)), None)
             if local_config_fail_key:
                 local_fail_info = summary[local_config_fail_key]; path_in_key = local_config_fail_key[len(local_config_key_prefix):-1] 
-                target_var_for_local_msg = error_to_diagnose.variable_name if hasattr(error_to_diagnose, 'variable_name') else display_variable_name
+                target_var_for_local_msg = getattr(error_to_diagnose, 'variable_name', display_variable_name)
                 msg_added_for_local = False
                 if isinstance(local_fail_info, FileNotFoundError): advice_parts.append(f"  - Local Config File Check ({path_in_key}): File was not found."); msg_added_for_local=True
                 elif isinstance(local_fail_info, PermissionError): advice_parts.append(f"  - Local Config File Check ({path_in_key}): Could not read the file due to permissions."); msg_added_for_local=True
@@ -697,8 +902,8 @@ class PiperClient:
             if not piper_tier_failure and not env_fail_msg and not local_config_fail_key and summary.get("SDKInternal"):
                 advice_parts.append(f"  - SDK Configuration: {summary.get('SDKInternal')}")
         elif isinstance(error_to_diagnose, PiperLinkNeededError): 
-            advice_parts.append(f"  - ACTION REQUIRED (Piper System): The Piper Link application needs to be connected.")
-            advice_parts.append(f"    Please ensure Piper Link is running on your computer and you are logged in.")
+            advice_parts.append("  - ACTION REQUIRED (Piper System): The Piper Link application needs to be connected.")
+            advice_parts.append("    Please ensure Piper Link is running on your computer and you are logged in.")
             if self.attempt_local_discovery and self.piper_link_service_url: advice_parts.append(f"    (The SDK tried to find it at: {self.piper_link_service_url})")
             actionable_advice_generated = True
         elif isinstance(error_to_diagnose, PiperGrantNeededError): 
@@ -711,8 +916,9 @@ class PiperClient:
             actionable_advice_generated = True 
         elif isinstance(error_to_diagnose, PiperAuthError): 
             advice_parts.append(f"  - Authentication/Authorization Issue with Piper System: {str(error_to_diagnose).splitlines()[0]}")
-            if hasattr(error_to_diagnose, 'error_details') and getattr(error_to_diagnose, 'error_details'):
-                details_preview = str(getattr(error_to_diagnose, 'error_details')); 
+            auth_error_details = getattr(error_to_diagnose, 'error_details', None)
+            if auth_error_details:
+                details_preview = str(auth_error_details)
                 if len(details_preview) > 100: details_preview = details_preview[:97] + "..."
                 advice_parts.append(f"    Details: {details_preview}")
         elif isinstance(error_to_diagnose, PiperError): 
@@ -726,23 +932,353 @@ class PiperClient:
             
         return "\n".join(advice_parts)
 
-    def get_credential_id_for_variable(self, variable_name: str, piper_link_instance_id_for_call: Optional[str] = None) -> str:
-        logger.warning("get_credential_id_for_variable is an advanced method; prefer get_secret().")
+    def _ensure_piper_available(self, disabled_message: str) -> None:
         if not self.client_initialization_ok: raise self._initialization_error or PiperConfigError("PiperClient is not properly initialized.")
-        if not self.use_piper: raise PiperConfigError("Cannot get credential_id: Piper usage is disabled in client configuration.")
-        target_instance_id = self._get_instance_id_for_api_call(piper_link_instance_id_for_call)
-        if not target_instance_id: raise PiperLinkNeededError("Instance ID required for resolving variable (neither provided nor discovered via Piper Link when enabled).")
+        if not self.use_piper: raise PiperConfigError(disabled_message)
+
+    def _clean_variable_name_for_lookup(self, variable_name: Any) -> str:
         if not variable_name or not isinstance(variable_name, str): raise PiperConfigError("variable_name must be a non-empty string for get_credential_id_for_variable.")
         original_variable_name_stripped = variable_name.strip()
         if not original_variable_name_stripped: raise PiperConfigError("variable_name cannot be empty after stripping for get_credential_id_for_variable.")
-        return self._resolve_piper_variable(original_variable_name_stripped, target_instance_id)
+        return original_variable_name_stripped
+
+    def _check_credential_ids_argument(self, credential_ids: Any) -> None:
+        if not credential_ids or not isinstance(credential_ids, list) or not all(isinstance(cid, str) and cid.strip() for cid in credential_ids):
+            raise PiperConfigError("credential_ids must be a non-empty list of non-empty strings for get_scoped_credentials_by_id.")
+
+    def _check_variable_names_argument(self, variable_names: Any) -> List[str]:
+        """Validates the names passed to get_scoped_credentials_for_variables and returns them stripped, deduplicated and in order."""
+        if not variable_names or not isinstance(variable_names, list) or not all(isinstance(name, str) and name.strip() for name in variable_names):
+            raise PiperConfigError("variable_names must be a non-empty list of non-empty strings for get_scoped_credentials_for_variables.")
+        return list(dict.fromkeys(name.strip() for name in variable_names))
+
+    def _split_cached_credential_ids(self, stripped_names: List[str], target_instance_id: str) -> Tuple[Dict[str, str], List[str]]:
+        credential_ids_by_variable: Dict[str, str] = {}
+        uncached_names: List[str] = []
+        for name in stripped_names:
+            cached_credential_id = self._cached_credential_id((target_instance_id, self._normalize_variable_name(name)))
+            if cached_credential_id is not None: credential_ids_by_variable[name] = cached_credential_id
+            else: uncached_names.append(name)
+        return credential_ids_by_variable, uncached_names
+
+    @staticmethod
+    def _unique_credential_ids(stripped_names: List[str], credential_ids_by_variable: Dict[str, str]) -> List[str]:
+        return list(dict.fromkeys(credential_ids_by_variable[name] for name in stripped_names))
+
+class PiperClient(_PiperClientBase):
+    """Synchronous Piper client. Network calls go through a pooled, retrying requests.Session; concurrent lookups use worker threads."""
+    LOCAL_LINK_PROBE_TIMEOUT_SECONDS: float = 0.05 # TCP probe before querying a localhost Piper Link over HTTP
+    DEFAULT_HTTP_POOL_CONNECTIONS: int = 4
+    DEFAULT_HTTP_POOL_MAXSIZE: int = 32
+    DEFAULT_EXECUTOR_MAX_WORKERS: int = 8
+    RETRY_STATUS_FORCELIST: Tuple[int, ...] = (502, 503, 504)
+    
+    def __init__(self,
+                 client_id: str,
+                 _piper_system_project_id: Optional[str] = None,
+                 _piper_system_region: Optional[str] = None,
+                 get_scoped_url: Optional[str] = None,
+                 resolve_mapping_url: Optional[str] = None,
+                 exchange_secret_url: Optional[str] = None,
+                 piper_link_service_url: Optional[str] = None,
+                 requests_session: Optional[requests.Session] = None,
+                 piper_link_instance_id: Optional[str] = None, 
+                 use_piper: bool = True,
+                 attempt_local_discovery: bool = True,
+                 fallback_to_env: bool = True,
+                 env_variable_prefix: str = "", 
+                 env_variable_map: Optional[Dict[str, str]] = None,
+                 fallback_to_local_config: bool = False,
+                 local_config_file_path: Optional[str] = None,
+                 piper_ui_grant_page_url: Optional[str] = None,
+                 http_pool_connections: int = DEFAULT_HTTP_POOL_CONNECTIONS,
+                 http_pool_maxsize: int = DEFAULT_HTTP_POOL_MAXSIZE,
+                 max_retries: Union[int, Retry] = _PiperClientBase.DEFAULT_MAX_RETRIES,
+                 prewarm_connections: bool = False,
+                 resolve_cache_ttl: float = _PiperClientBase.DEFAULT_RESOLVE_CACHE_TTL_SECONDS,
+                 grant_needed_cache_ttl: float = _PiperClientBase.DEFAULT_GRANT_NEEDED_CACHE_TTL_SECONDS,
+                 cache_sts_tokens: bool = True,
+                 cache_raw_secrets: bool = False,
+                 discovery_negative_ttl: float = _PiperClientBase.DEFAULT_DISCOVERY_NEGATIVE_TTL_SECONDS,
+                 snapshot_env: bool = False,
+                 sts_expiry_buffer: float = _PiperClientBase.DEFAULT_STS_EXPIRY_BUFFER_SECONDS
+                ):
+        super().__init__(client_id, _piper_system_project_id=_piper_system_project_id, _piper_system_region=_piper_system_region,
+                         get_scoped_url=get_scoped_url, resolve_mapping_url=resolve_mapping_url, exchange_secret_url=exchange_secret_url,
+                         piper_link_service_url=piper_link_service_url, piper_link_instance_id=piper_link_instance_id, use_piper=use_piper,
+                         attempt_local_discovery=attempt_local_discovery, fallback_to_env=fallback_to_env, env_variable_prefix=env_variable_prefix,
+                         env_variable_map=env_variable_map, fallback_to_local_config=fallback_to_local_config,
+                         local_config_file_path=local_config_file_path, piper_ui_grant_page_url=piper_ui_grant_page_url,
+                         resolve_cache_ttl=resolve_cache_ttl, grant_needed_cache_ttl=grant_needed_cache_ttl, cache_sts_tokens=cache_sts_tokens,
+                         cache_raw_secrets=cache_raw_secrets, discovery_negative_ttl=discovery_negative_ttl, snapshot_env=snapshot_env,
+                         sts_expiry_buffer=sts_expiry_buffer)
+        self._owns_session: bool = not requests_session # A caller-supplied session is the caller's to close
+        self._session: requests.Session = requests_session or create_session(http_pool_connections, http_pool_maxsize, max_retries)
+        self._session.headers.update({'User-Agent': self._user_agent})
+        self._discovery_lock = threading.Lock()
+        self._executor: Optional[concurrent.futures.ThreadPoolExecutor] = None # Created on first concurrent fan-out, reused after
+        self._executor_lock = threading.Lock()
+
+        if prewarm_connections and self.client_initialization_ok and self.use_piper:
+            threading.Thread(target=self.prewarm, kwargs={'discover_instance': True}, name='piper-sdk-prewarm', daemon=True).start()
+
+    def prewarm(self, timeout: float = 2.0, discover_instance: bool = False) -> int:
+        """
+        Opens pooled connections to the Piper backend hosts ahead of the first real call,
+        so DNS, TCP and TLS setup is not paid by the first get_secret().
+        Sends a cheap HEAD to each endpoint and ignores the response. With discover_instance=True
+        it also runs Piper Link discovery (when enabled) so its result is cached. Never raises.
+        Returns the number of backend endpoints that answered.
+        """
+        if not self.client_initialization_ok or not self.use_piper:
+            logger.debug("prewarm skipped: client is misconfigured or Piper usage is disabled.")
+            return 0
+        if discover_instance and self._should_prewarm_discovery(): self.discover_local_instance_id()
+        warmed = 0
+        for url in (self.resolve_mapping_url, self.get_scoped_url, self.exchange_secret_url):
+            if not url: continue
+            try:
+                self._session.head(url, timeout=timeout, allow_redirects=False)
+                warmed += 1
+            except Exception as e:
+                logger.debug("prewarm: could not reach %s: %s", url, e)
+        logger.debug("prewarm: %d Piper endpoint(s) answered.", warmed)
+        return warmed
+
+    def _get_executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        if self._resource_owner is not None: return self._resource_owner._get_executor()
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.DEFAULT_EXECUTOR_MAX_WORKERS, thread_name_prefix='piper-sdk')
+        return self._executor
+
+    def close(self) -> None:
+        """
+        Releases resources held by the client: shuts down the worker threads used for
+        concurrent lookups and closes the pooled HTTP connections, unless the session was
+        passed in as requests_session. Safe to call more than once. On a client returned
+        by with_overrides() or with_fallback() this does nothing; the shared resources belong to the original.
+        """
+        if self._resource_owner is not None: return
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+        if self._owns_session:
+            self._session.close()
+
+    def __enter__(self) -> "PiperClient":
+        return self
+
+    def __exit__(self, exc_type: Any, exc_value: Any, traceback: Any) -> None:
+        self.close()
+
+    def discover_local_instance_id(self, force_refresh: bool = False) -> Optional[str]:
+        answered, instance_id = self._discovery_shortcut(force_refresh)
+        if answered: return instance_id
+        with self._discovery_state()._discovery_lock:
+            # Another thread may have finished discovery while this one waited for the lock.
+            answered, instance_id = self._discovery_shortcut(force_refresh)
+            if answered: return instance_id
+            return self._record_discovery_result(self._query_local_instance_id())
+
+    def _piper_link_refuses_connections(self) -> bool:
+        """True when a localhost Piper Link URL's port is closed, found with a bare TCP connect instead of a full HTTP request."""
+        parts = urlsplit(self.piper_link_service_url)
+        if parts.hostname not in ('localhost', '127.0.0.1', '::1'): return False
+        try:
+            socket.create_connection((parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80)), timeout=self.LOCAL_LINK_PROBE_TIMEOUT_SECONDS).close()
+        except ConnectionRefusedError: return True
+        except (OSError, ValueError): pass # Timeouts or odd URLs: let the HTTP request decide
+        return False
+
+    def _query_local_instance_id(self) -> Optional[str]:
+        logger.info("Attempting to discover Piper Link instanceId from: %s", self.piper_link_service_url)
+        if self._piper_link_refuses_connections():
+            logger.warning("Local Piper Link service not found/running at %s.", self.piper_link_service_url)
+            return None
+        try:
+            response = self._session.get(self.piper_link_service_url, timeout=1.0)
+            response.raise_for_status()
+            return self._instance_id_from_link_context(_json_loads(response.content))
+        except requests.exceptions.ConnectionError: logger.warning(f"Local Piper Link service not found/running at {self.piper_link_service_url}.")
+        except requests.exceptions.Timeout: logger.warning(f"Timeout connecting to local Piper Link service at {self.piper_link_service_url}.")
+        except requests.exceptions.RequestException as e: logger.warning(f"Request error querying local Piper Link service at {self.piper_link_service_url}: {e}")
+        except json.JSONDecodeError as e: logger.warning(f"JSON decode error from local Piper Link service at {self.piper_link_service_url}: {e}")
+        except Exception as e: logger.error(f"Unexpected error querying local Piper Link service at {self.piper_link_service_url}: {e}", exc_info=True)
+        return None
+
+    def _get_instance_id_for_api_call(self, piper_link_instance_id_for_call: Optional[str]) -> Optional[str]:
+        if piper_link_instance_id_for_call:
+            logger.debug("Using instance_id passed directly to API call method: %s", piper_link_instance_id_for_call)
+            return piper_link_instance_id_for_call
+        if self._configured_instance_id:
+            logger.debug("Using instance_id explicitly provided at PiperClient initialization: %s", self._configured_instance_id)
+            return self._configured_instance_id
+        if self.attempt_local_discovery:
+            return self.discover_local_instance_id()
+        logger.debug("No explicit instance_id provided, and local discovery is disabled.")
+        return self._discovered_instance_id
+
+    def _resolve_piper_variable(self, variable_name: str, instance_id_for_context: str, use_cache: bool = True) -> str:
+        normalized_name, cached_credential_id = self._lookup_credential_id(variable_name, instance_id_for_context, use_cache)
+        if cached_credential_id is not None: return cached_credential_id
+        try:
+            payload = self._resolve_payload(variable_name, normalized_name, instance_id_for_context)
+            response = self._session.post(self.resolve_mapping_url, headers=self._json_headers, data=_json_dumps(payload), timeout=12)
+            return self._handle_resolve_response(response, variable_name, normalized_name, instance_id_for_context)
+        except (PiperGrantNeededError, PiperAuthError, PiperForbiddenError, ValueError): raise
+        except requests.exceptions.RequestException as e:
+            status_code = e.response.status_code if e.response is not None else None;
+            logger.error(f"Network error calling {self.resolve_mapping_url} for var '{normalized_name}'. Status: {status_code}", exc_info=True)
+            raise PiperError(f"Network error resolving variable: {e}") from e
+        except Exception as e:
+            logger.error(f"Unexpected error resolving variable '{normalized_name}': {e}", exc_info=True)
+            raise PiperError(f"Unexpected error resolving variable: {e}") from e
+
+    def _fetch_piper_sts_token(self, credential_ids: List[str], instance_id_for_context: str) -> Dict[str, Any]:
+        cleaned_credential_ids = self._clean_credential_ids(credential_ids)
+        try:
+            payload = self._scoped_payload(cleaned_credential_ids, instance_id_for_context)
+            response = self._session.post(self.get_scoped_url, headers=self._json_headers, data=_json_dumps(payload), timeout=15)
+            return self._handle_scoped_response(response, cleaned_credential_ids, instance_id_for_context)
+        except (PiperAuthError, PiperForbiddenError, ValueError): raise
+        except requests.exceptions.RequestException as e:
+            status_code = e.response.status_code if e.response is not None else None
+            logger.error(f"Network error calling {self.get_scoped_url}. Status: {status_code}", exc_info=True)
+            raise PiperError(f"Network error getting scoped creds: {e}") from e
+        except Exception as e:
+            logger.error(f"Unexpected error getting scoped creds: {e}", exc_info=True)
+            raise PiperError(f"Unexpected error getting scoped creds: {e}") from e
+
+    def _perform_piper_tier(self, variable_name: str, piper_link_instance_id_for_call: Optional[str], fetch_raw_secret: bool) -> Dict[str, Any]:
+        effective_instance_id = self._get_instance_id_for_api_call(piper_link_instance_id_for_call)
+        if not effective_instance_id: raise self._link_needed_error(piper_link_instance_id_for_call)
+        logger.debug("GET_SECRET '%s': Using instance_id '%s' for Piper flow (Agent: %s...).", variable_name, effective_instance_id, self._client_id_short)
+        cached_secret_info = self._cached_piper_secret(variable_name, effective_instance_id, fetch_raw_secret)
+        if cached_secret_info is not None: return cached_secret_info
+        credential_id = self._resolve_piper_variable(variable_name, effective_instance_id)
+        try:
+            piper_sts_response_data = self._fetch_piper_sts_token([credential_id], effective_instance_id)
+        except PiperAuthError:
+            # A cached mapping may point at a credential whose grant was since revoked.
+            self._forget_credential_id(variable_name, effective_instance_id)
+            raise
+        granted_piper_cred_id = piper_sts_response_data.get('granted_credential_ids', [credential_id])[0]
+        if not fetch_raw_secret:
+            return self._remember_piper_secret(piper_sts_response_data, self._sts_secret_info(variable_name, piper_sts_response_data, granted_piper_cred_id, effective_instance_id))
+        exchange_payload = self._exchange_payload(variable_name, granted_piper_cred_id, effective_instance_id)
+        api_response = self._session.post(self.exchange_secret_url, headers=self._json_headers, data=_json_dumps(exchange_payload), timeout=10)
+        return self._remember_piper_secret(piper_sts_response_data, self._raw_secret_info(variable_name, api_response, granted_piper_cred_id, effective_instance_id))
+
+    def _perform_get_secret(self, variable_name: str, piper_link_instance_id_for_call: Optional[str] = None, fetch_raw_secret: bool = False) -> Dict[str, Any]:
+        attempted_sources_summary: Dict[str, Any] = {}
+        if self.use_piper:
+            logger.info("GET_SECRET '%s': Attempting Piper tier.", variable_name)
+            try:
+                return self._perform_piper_tier(variable_name, piper_link_instance_id_for_call, fetch_raw_secret)
+            except Exception as e:
+                attempted_sources_summary["Piper"] = self._piper_tier_failure(variable_name, e)
+        return self._perform_fallback_tiers(variable_name, attempted_sources_summary)
+
+    def get_secret(self, variable_name: str, piper_link_instance_id_for_call: Optional[str] = None, fetch_raw_secret: bool = False, raise_on_failure: bool = True) -> Optional[Dict[str, Any]]:
+        error_key_for_storage, early_failure = self._check_get_secret_call(variable_name, raise_on_failure)
+        if early_failure is not None: return early_failure
+        try:
+            secret_info = self._perform_get_secret(error_key_for_storage, piper_link_instance_id_for_call, fetch_raw_secret)
+            self._last_get_secret_errors.pop(error_key_for_storage, None)
+            return secret_info
+        except Exception as e:
+            return self._get_secret_failed(error_key_for_storage, e, raise_on_failure)
+
+    def get_secrets(self, variable_names: List[str], piper_link_instance_id_for_call: Optional[str] = None, fetch_raw_secret: bool = False, raise_on_failure: bool = True) -> Dict[str, Optional[Dict[str, Any]]]:
+        """
+        Calls get_secret() for each name, running the lookups concurrently on the client's worker
+        threads, and returns {variable name: get_secret() result} in the given order (duplicates
+        collapse to one lookup). With raise_on_failure=True the first failure in that order is raised.
+        """
+        unique_names = self._check_get_secrets_argument(variable_names)
+        if len(unique_names) == 1:
+            return {unique_names[0]: self.get_secret(unique_names[0], piper_link_instance_id_for_call, fetch_raw_secret, raise_on_failure)}
+        executor = self._get_executor()
+        futures = {name: executor.submit(self.get_secret, name, piper_link_instance_id_for_call, fetch_raw_secret, raise_on_failure) for name in unique_names}
+        return {name: future.result() for name, future in futures.items()}
+
+    def is_grant_still_active(self, variable_name: str,
+                                piper_link_instance_id_for_call: Optional[str] = None,
+                                store_error_if_inactive: bool = True) -> bool:
+        error_key_for_storage = self._check_grant_check_call(variable_name, store_error_if_inactive)
+        if error_key_for_storage is None: return True
+        effective_instance_id: Optional[str] = None
+        try:
+            effective_instance_id = self._get_instance_id_for_api_call(piper_link_instance_id_for_call)
+            if not effective_instance_id:
+                raise PiperLinkNeededError("Instance ID required for grant check, but not available (discovery disabled or failed, and none provided).")
+        except PiperLinkNeededError as e_link_direct:
+            if store_error_if_inactive: self._last_get_secret_errors[error_key_for_storage] = e_link_direct
+            raise
+        try:
+            credential_id = self._resolve_piper_variable(error_key_for_storage, effective_instance_id, use_cache=False)
+        except (PiperError, ValueError) as e:
+            return self._grant_check_failed(error_key_for_storage, e, store_error_if_inactive)
+        return self._grant_check_passed(error_key_for_storage, credential_id)
+
+    def get_credential_id_for_variable(self, variable_name: str, piper_link_instance_id_for_call: Optional[str] = None) -> str:
+        logger.warning("get_credential_id_for_variable is an advanced method; prefer get_secret().")
+        self._ensure_piper_available("Cannot get credential_id: Piper usage is disabled in client configuration.")
+        target_instance_id = self._get_instance_id_for_api_call(piper_link_instance_id_for_call)
+        if not target_instance_id: raise PiperLinkNeededError("Instance ID required for resolving variable (neither provided nor discovered via Piper Link when enabled).")
+        return self._resolve_piper_variable(self._clean_variable_name_for_lookup(variable_name), target_instance_id)
 
     def get_scoped_credentials_by_id(self, credential_ids: List[str], piper_link_instance_id_for_call: Optional[str] = None) -> Dict[str, Any]:
         logger.warning("get_scoped_credentials_by_id is an advanced method; prefer get_secret().")
-        if not self.client_initialization_ok: raise self._initialization_error or PiperConfigError("PiperClient is not properly initialized.")
-        if not self.use_piper: raise PiperConfigError("Cannot get scoped credentials by ID: Piper usage is disabled in client configuration.")
+        self._ensure_piper_available("Cannot get scoped credentials by ID: Piper usage is disabled in client configuration.")
         target_instance_id = self._get_instance_id_for_api_call(piper_link_instance_id_for_call)
         if not target_instance_id: raise PiperLinkNeededError("Instance ID required for fetching scoped credentials (neither provided nor discovered via Piper Link when enabled).")
-        if not credential_ids or not isinstance(credential_ids, list) or not all(isinstance(cid, str) and cid.strip() for cid in credential_ids):
-            raise PiperConfigError("credential_ids must be a non-empty list of non-empty strings for get_scoped_credentials_by_id.")
-        return self._fetch_piper_sts_token(credential_ids, target_instance_id)
\ No newline at end of file
+        self._check_credential_ids_argument(credential_ids)
+        return self._fetch_piper_sts_token(credential_ids, target_instance_id)
+
+    def get_scoped_credentials_for_variables(self, variable_names: List[str], piper_link_instance_id_for_call: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Resolves several variable names and fetches one STS token scoped to all of their credentials.
+        Names whose credentialId is not cached are resolved concurrently, then a single
+        get_scoped_credentials call is made. The returned dict is the get_scoped_credentials
+        response plus 'credential_ids_by_variable' (stripped variable name -> credentialId).
+        """
+        logger.warning("get_scoped_credentials_for_variables is an advanced method; prefer get_secret().")
+        self._ensure_piper_available("Cannot get scoped credentials for variables: Piper usage is disabled in client configuration.")
+        stripped_names = self._check_variable_names_argument(variable_names)
+        target_instance_id = self._get_instance_id_for_api_call(piper_link_instance_id_for_call)
+        if not target_instance_id: raise PiperLinkNeededError("Instance ID required for fetching scoped credentials (neither provided nor discovered via Piper Link when enabled).")
+        credential_ids_by_variable, uncached_names = self._split_cached_credential_ids(stripped_names, target_instance_id)
+        if len(uncached_names) == 1:
+            credential_ids_by_variable[uncached_names[0]] = self._resolve_piper_variable(uncached_names[0], target_instance_id)
+        elif uncached_names:
+            executor = self._get_executor()
+            futures = {name: executor.submit(self._resolve_piper_variable, name, target_instance_id) for name in uncached_names}
+            for name, future in futures.items(): credential_ids_by_variable[name] = future.result()
+        scoped_data = self._fetch_piper_sts_token(self._unique_credential_ids(stripped_names, credential_ids_by_variable), target_instance_id)
+        scoped_data['credential_ids_by_variable'] = {name: credential_ids_by_variable[name] for name in stripped_names}
+        return scoped_data
+
+
+def create_session(pool_connections: int = PiperClient.DEFAULT_HTTP_POOL_CONNECTIONS,
+                   pool_maxsize: int = PiperClient.DEFAULT_HTTP_POOL_MAXSIZE,
+                   max_retries: Union[int, Retry] = PiperClient.DEFAULT_MAX_RETRIES) -> requests.Session:
+    """
+    Builds the pooled, retrying requests.Session a PiperClient uses when none is passed in.
+    Create one and pass it as requests_session to several clients so they share warm
+    connections; the caller then owns it and closes it when done.
+    """
+    # One pool per Piper host (resolve, get-scoped, exchange, local link) keeps TLS sessions warm across calls.
+    # Transient Cloud Run failures are retried on the warm connection; the local Piper Link (http://) is not
+    # retried so that discovery still fails fast when the app is not running.
+    session = requests.Session()
+    if isinstance(max_retries, Retry): retry = max_retries
+    else:
+        retry = Retry(total=max_retries, backoff_factor=0.2, status_forcelist=PiperClient.RETRY_STATUS_FORCELIST,
+                      allowed_methods=frozenset(['HEAD', 'GET', 'POST']), respect_retry_after_header=True, raise_on_status=False)
+    session.mount('https://', HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=False, max_retries=retry))
+    session.mount('http://', HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=False))
+    return session
@@ -14,8 +14,13 @@ setuptools.setup(
 
     install_requires=[
         "requests>=2.20.0",
+        "urllib3>=1.26.0", # Retry(allowed_methods=...)
         # "keyring>=23.0.0", # Currently not supported
     ],
+    extras_require={
+        "speedups": ["orjson>=3.0"], # Faster JSON encode/decode for Piper API calls
+        "async": ["httpx[http2]>=0.23"], # AsyncPiperClient
+    },
     python_requires='>=3.7',
     classifiers=[
         "Programming Language :: Python :: 3",
@@ -0,0 +1,179 @@
+# test_async_client.py
+import asyncio
+import json
+import subprocess
+import sys
+import unittest
+from unittest.mock import patch
+
+from urllib3.util.retry import Retry
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+from piper_sdk.client import PiperClient, PiperConfigError, PiperGrantNeededError, PiperSecretAcquisitionError, _LINK_DISCOVERY_CACHE
+from piper_sdk.async_client import AsyncPiperClient
+
+@unittest.skipIf(httpx is None, "httpx is not installed")
+class TestAsyncPiperClient(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        _LINK_DISCOVERY_CACHE.clear()
+        self.client_id = "test_agent_client_id_123"
+        self.instance_id = "instance_abc987"
+        self.requests_seen = []
+        self.resolve_status = 200
+        self.link_available = True
+
+    def handler(self, request):
+        self.requests_seen.append(request)
+        url = str(request.url)
+        if url.startswith(PiperClient.DEFAULT_PIPER_LINK_SERVICE_URL):
+            if not self.link_available: raise httpx.ConnectError("connection refused", request=request)
+            return httpx.Response(200, json={"instanceId": self.instance_id})
+        body = json.loads(request.content)
+        if url.startswith(PiperClient.DEFAULT_PIPER_RESOLVE_MAPPING_URL):
+            if self.resolve_status == 404:
+                return httpx.Response(404, json={"error": "mapping_not_found", "error_description": "No mapping"})
+            return httpx.Response(200, json={"credentialId": "cred_" + body["variableName"]})
+        if url.startswith(PiperClient.DEFAULT_PIPER_GET_SCOPED_URL):
+            return httpx.Response(200, json={"access_token": "sts_token", "expires_in": 3600, "granted_credential_ids": body["credentialIds"]})
+        if url.startswith(PiperClient.DEFAULT_PIPER_EXCHANGE_SECRET_URL):
+            return httpx.Response(200, json={"secret_value": "raw_" + body["piperCredentialId"]})
+        return httpx.Response(500)
+
+    async def make_client(self, **kwargs):
+        http = httpx.AsyncClient(transport=httpx.MockTransport(self.handler))
+        self.addAsyncCleanup(http.aclose)
+        kwargs.setdefault('fallback_to_env', False)
+        return AsyncPiperClient(self.client_id, httpx_client=http, **kwargs)
+
+    def urls_seen(self, prefix):
+        return [r for r in self.requests_seen if str(r.url).startswith(prefix)]
+
+    async def test_get_secret_sts_discovers_resolves_and_fetches(self):
+        client = await self.make_client()
+        result = await client.get_secret("TEST_API_KEY")
+        self.assertEqual(result["value"], "sts_token")
+        self.assertEqual(result["source"], "piper_sts")
+        self.assertEqual(result["piper_credential_id"], "cred_test_api_key")
+        self.assertEqual(result["piper_instance_id"], self.instance_id)
+        scoped_request = self.urls_seen(PiperClient.DEFAULT_PIPER_GET_SCOPED_URL)[0]
+        self.assertEqual(scoped_request.headers["Content-Type"], "application/json")
+        self.assertEqual(json.loads(scoped_request.content), {"agentClientId": self.client_id, "instanceId": self.instance_id, "credentialIds": ["cred_test_api_key"]})
+
+    async def test_get_secret_reuses_cached_credential_id(self):
+        client = await self.make_client(piper_link_instance_id=self.instance_id, cache_sts_tokens=False)
+        await client.get_secret("TEST_API_KEY")
+        await client.get_secret("TEST_API_KEY")
+        self.assertEqual(len(self.urls_seen(PiperClient.DEFAULT_PIPER_RESOLVE_MAPPING_URL)), 1)
+        self.assertEqual(len(self.urls_seen(PiperClient.DEFAULT_PIPER_GET_SCOPED_URL)), 2)
+        self.assertEqual(self.urls_seen(PiperClient.DEFAULT_PIPER_LINK_SERVICE_URL), [])
+
+    async def test_get_secret_reuses_unexpired_sts_token(self):
+        client = await self.make_client(piper_link_instance_id=self.instance_id)
+        first = await client.get_secret("TEST_API_KEY")
+        second = await client.get_secret("TEST_API_KEY")
+        self.assertEqual(second["value"], first["value"])
+        self.assertEqual(len(self.requests_seen), 2)
+
+    async def test_get_secret_raw_secret(self):
+        client = await self.make_client(piper_link_instance_id=self.instance_id)
+        result = await client.get_secret("TEST_API_KEY", fetch_raw_secret=True)
+        self.assertEqual(result["value"], "raw_cred_test_api_key")
+        self.assertEqual(result["source"], "piper_raw_secret")
+
+    async def test_get_secret_grant_needed_without_raising(self):
+        self.resolve_status = 404
+        client = await self.make_client(piper_link_instance_id=self.instance_id)
+        result = await client.get_secret("TEST_API_KEY", raise_on_failure=False)
+        self.assertEqual(result["source"], "piper_grant_needed")
+        self.assertIsInstance(client.get_last_error_for_variable("TEST_API_KEY"), PiperSecretAcquisitionError)
+        with self.assertRaises(PiperSecretAcquisitionError) as ctx:
+            await client.get_secret("TEST_API_KEY")
+        self.assertIsInstance(ctx.exception.attempted_sources_summary["Piper"], PiperGrantNeededError)
+
+    async def test_get_secrets_gathers_lookups(self):
+        client = await self.make_client(piper_link_instance_id=self.instance_id)
+        results = await client.get_secrets(["VAR_A", "VAR_B", "VAR_A"])
+        self.assertEqual({name: info["piper_credential_id"] for name, info in results.items()}, {"VAR_A": "cred_var_a", "VAR_B": "cred_var_b"})
+        self.assertEqual(len(self.urls_seen(PiperClient.DEFAULT_PIPER_GET_SCOPED_URL)), 2)
+        self.resolve_status = 404
+        client.invalidate_resolve_cache()
+        with self.assertRaises(PiperSecretAcquisitionError):
+            await client.get_secrets(["VAR_A", "VAR_B"])
+
+    async def test_concurrent_discovery_queries_link_once(self):
+        client = await self.make_client()
+        results = await asyncio.gather(*(client.discover_local_instance_id() for _ in range(10)))
+        self.assertEqual(results, [self.instance_id] * 10)
+        self.assertEqual(len(self.urls_seen(PiperClient.DEFAULT_PIPER_LINK_SERVICE_URL)), 1)
+
+    async def test_failed_discovery_is_negatively_cached(self):
+        self.link_available = False
+        client = await self.make_client()
+        self.assertIsNone(await client.discover_local_instance_id())
+        self.assertIsNone(await client.discover_local_instance_id())
+        self.assertEqual(len(self.urls_seen(PiperClient.DEFAULT_PIPER_LINK_SERVICE_URL)), 1)
+
+    async def test_prewarm_can_cache_local_discovery(self):
+        client = await self.make_client()
+        await client.prewarm()
+        self.assertEqual(self.urls_seen(PiperClient.DEFAULT_PIPER_LINK_SERVICE_URL), [])
+        await client.prewarm(discover_instance=True)
+        self.assertEqual(client._discovered_instance_id, self.instance_id)
+
+    async def test_derived_client_discovers_through_coroutines_without_requests_session(self):
+        client = await self.make_client()
+        derived = client.with_overrides(fallback_to_env=True)
+        self.assertNotIsInstance(derived, PiperClient)
+        self.assertFalse(hasattr(client, '_session'))
+        self.assertEqual(await derived.get_credential_id_for_variable("TEST_API_KEY"), "cred_test_api_key")
+        self.assertEqual(await client.discover_local_instance_id(), self.instance_id)
+        self.assertEqual(len(self.urls_seen(PiperClient.DEFAULT_PIPER_LINK_SERVICE_URL)), 1)
+
+    async def test_is_grant_still_active(self):
+        client = await self.make_client(piper_link_instance_id=self.instance_id)
+        self.assertTrue(await client.is_grant_still_active("TEST_API_KEY"))
+        self.resolve_status = 404
+        self.assertFalse(await client.is_grant_still_active("TEST_API_KEY"))
+        self.assertIsInstance(client.get_last_error_for_variable("TEST_API_KEY"), PiperGrantNeededError)
+
+    async def test_scoped_credentials_for_variables_makes_one_scoped_call(self):
+        client = await self.make_client(piper_link_instance_id=self.instance_id)
+        result = await client.get_scoped_credentials_for_variables(["VAR_A", "VAR_B", " VAR_A "])
+        self.assertEqual(result["credential_ids_by_variable"], {"VAR_A": "cred_var_a", "VAR_B": "cred_var_b"})
+        self.assertEqual(len(self.urls_seen(PiperClient.DEFAULT_PIPER_RESOLVE_MAPPING_URL)), 2)
+        scoped_requests = self.urls_seen(PiperClient.DEFAULT_PIPER_GET_SCOPED_URL)
+        self.assertEqual(len(scoped_requests), 1)
+        self.assertEqual(json.loads(scoped_requests[0].content)["credentialIds"], ["cred_var_a", "cred_var_b"])
+
+    async def test_env_fallback_without_piper(self):
+        client = await self.make_client(use_piper=False, fallback_to_env=True, env_variable_map={"MY_KEY": "ASYNC_SDK_TEST_MY_KEY"})
+        with patch.dict('os.environ', {"ASYNC_SDK_TEST_MY_KEY": "env_value"}):
+            result = await client.get_secret("MY_KEY")
+        self.assertEqual(result["value"], "env_value")
+        self.assertEqual(self.requests_seen, [])
+
+    async def test_aclose_leaves_injected_client_open_and_closes_owned_one(self):
+        client = await self.make_client()
+        await client.aclose()
+        self.assertFalse(client._http.is_closed)
+        async with AsyncPiperClient(self.client_id) as owned_client:
+            http = owned_client._http
+        self.assertTrue(http.is_closed)
+
+    def test_max_retries_must_be_an_int(self):
+        with self.assertRaisesRegex(PiperConfigError, "max_retries must be an int"):
+            AsyncPiperClient(self.client_id, max_retries=Retry(total=0))
+
+class TestAsyncClientImport(unittest.TestCase):
+    def test_package_import_defers_async_client(self):
+        code = ("import sys, piper_sdk; assert 'piper_sdk.async_client' not in sys.modules; "
+                "from piper_sdk import AsyncPiperClient; assert AsyncPiperClient.__module__ == 'piper_sdk.async_client'; "
+                "assert piper_sdk.AsyncPiperClient is AsyncPiperClient")
+        subprocess.run([sys.executable, "-c", code], check=True)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,11 +4,18 @@ from unittest.mock import patch, MagicMock, mock_open
 import os
 import json
 import requests 
+from urllib3.util.retry import Retry
 import re # ADDED
+import threading
+import time
+import itertools
+import socket
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 from piper_sdk.client import (
     PiperClient, PiperError, PiperConfigError, PiperLinkNeededError, PiperAuthError,
-    PiperGrantNeededError, PiperForbiddenError, PiperRawSecretExchangeError, PiperSecretAcquisitionError
+    PiperGrantNeededError, PiperForbiddenError, PiperRawSecretExchangeError, PiperSecretAcquisitionError, create_session,
+    _LINK_DISCOVERY_CACHE
 )
 
 def mock_response(status_code=200, json_data=None, text_data=None, headers=None): # Same as before
@@ -17,6 +24,7 @@ def mock_response(status_code=200, json_data=None, text_data=None, headers=None)
     if json_data is not None:
         mock_resp.json = MagicMock(return_value=json_data)
     mock_resp.text = text_data if text_data is not None else (json.dumps(json_data) if json_data is not None else "")
+    mock_resp.content = mock_resp.text.encode('utf-8')
     mock_resp.headers = headers or {'Content-Type': 'application/json'}
     if status_code >= 400:
         http_error = requests.exceptions.HTTPError(f"Mock HTTP Error {status_code}")
@@ -38,6 +46,10 @@ def create_mock_psae(variable_name, piper_error_obj=None, env_error_str=None, lo
 
 class TestPiperClientRegression(unittest.TestCase): # Mostly same, one fix
     def setUp(self):
+        _LINK_DISCOVERY_CACHE.clear()
+        probe_patcher = patch('piper_sdk.client.PiperClient._piper_link_refuses_connections', return_value=False) # Discovery here is mocked at the HTTP layer
+        probe_patcher.start()
+        self.addCleanup(probe_patcher.stop)
         self.client_id = "test_agent_client_id_123"
         self.variable_name = "TEST_API_KEY"
         self.normalized_variable_name = "test_api_key" 
@@ -76,9 +88,9 @@ class TestPiperClientRegression(unittest.TestCase): # Mostly same, one fix
 
     @patch('requests.Session.post')
     @patch('piper_sdk.client.PiperClient.discover_local_instance_id')
-    @patch('os.environ.get', return_value=None) 
+    @patch.dict(os.environ, {}, clear=True)
     @patch('os.path.exists', return_value=False) 
-    def test_get_secret_piper_grant_needed_raises_psae(self, mock_exists, mock_env_get, mock_discover_id, mock_post):
+    def test_get_secret_piper_grant_needed_raises_psae(self, mock_exists, mock_discover_id, mock_post):
         # FIX: Enable local config for this test
         self.client = PiperClient(
             client_id=self.client_id,
@@ -96,9 +108,9 @@ class TestPiperClientRegression(unittest.TestCase): # Mostly same, one fix
         self.assertIn(f"LocalConfigFile (/mock/dummy_path.json)", psae.attempted_sources_summary)
 
     @patch('piper_sdk.client.PiperClient.discover_local_instance_id')
-    @patch('os.environ.get', return_value=None) 
+    @patch.dict(os.environ, {}, clear=True)
     @patch('os.path.exists', return_value=False) 
-    def test_get_secret_piper_link_needed_raises_psae(self, mock_exists, mock_env_get, mock_discover_id): # No change
+    def test_get_secret_piper_link_needed_raises_psae(self, mock_exists, mock_discover_id): # No change
         mock_discover_id.return_value = None 
         self.client._configured_instance_id = None 
         with self.assertRaises(PiperSecretAcquisitionError) as cm:
@@ -107,8 +119,7 @@ class TestPiperClientRegression(unittest.TestCase): # Mostly same, one fix
         self.assertIsInstance(psae.attempted_sources_summary["Piper"], PiperLinkNeededError)
 
     @patch('piper_sdk.client.PiperClient.discover_local_instance_id', return_value=None) 
-    @patch('os.environ.get')
-    def test_get_secret_env_var_success_after_piper_fail(self, mock_env_get, mock_discover_id): # No change (re import was the fix)
+    def test_get_secret_env_var_success_after_piper_fail(self, mock_discover_id): # No change (re import was the fix)
         self.client._configured_instance_id = None
         expected_env_value = "secret_from_env_yay"
         sdk_generated_env_var_name = self.variable_name.upper().replace('-', '_').replace(' ', '_')
@@ -116,16 +127,16 @@ class TestPiperClientRegression(unittest.TestCase): # Mostly same, one fix
         sdk_generated_env_var_name = re.sub(r'_+', '_', sdk_generated_env_var_name)
         if self.client.env_variable_prefix:
             sdk_generated_env_var_name = f"{self.client.env_variable_prefix}{sdk_generated_env_var_name}"
-        mock_env_get.side_effect = lambda k: expected_env_value if k == sdk_generated_env_var_name else None
-        secret_info = self.client.get_secret(self.variable_name)
+        with patch.dict(os.environ, {sdk_generated_env_var_name: expected_env_value}, clear=True):
+            secret_info = self.client.get_secret(self.variable_name)
         self.assertEqual(secret_info["value"], expected_env_value)
         self.assertEqual(secret_info["env_var_name_used"], sdk_generated_env_var_name)
 
     @patch('piper_sdk.client.PiperClient.discover_local_instance_id', return_value=None) 
-    @patch('os.environ.get', return_value=None) 
+    @patch.dict(os.environ, {}, clear=True)
     @patch('os.path.exists', return_value=True)
     @patch('os.access', return_value=True)
-    def test_get_secret_local_config_success_after_piper_env_fail(self, mock_access, mock_exists, mock_env_get, mock_discover_id): # No change
+    def test_get_secret_local_config_success_after_piper_env_fail(self, mock_access, mock_exists, mock_discover_id): # No change
         self.client._configured_instance_id = None
         config_file_path = "/fake/path/to/secrets.json"
         self.client = PiperClient(client_id=self.client_id, fallback_to_local_config=True, local_config_file_path=config_file_path)
@@ -137,9 +148,9 @@ class TestPiperClientRegression(unittest.TestCase): # Mostly same, one fix
         self.assertEqual(secret_info["source"], "local_config_file")
 
     @patch('piper_sdk.client.PiperClient.discover_local_instance_id', return_value=None) 
-    @patch('os.environ.get', return_value=None) 
+    @patch.dict(os.environ, {}, clear=True)
     @patch('os.path.exists') 
-    def test_get_secret_all_tiers_fail_psae(self, mock_exists, mock_env_get, mock_discover_id): # No change
+    def test_get_secret_all_tiers_fail_psae(self, mock_exists, mock_discover_id): # No change
         self.client._configured_instance_id = None
         config_file_path = "/fake/path/nonexistent.json"
         self.client = PiperClient(client_id=self.client_id, fallback_to_local_config=True, local_config_file_path=config_file_path)
@@ -156,6 +167,16 @@ class TestPiperClientRegression(unittest.TestCase): # Mostly same, one fix
         with self.assertRaisesRegex(PiperConfigError, "variable_name cannot be empty or all whitespace after stripping"):
             self.client.get_secret("   ", raise_on_failure=True)
 
+    def test_parse_api_error_json_body(self):
+        resp = mock_response(403, {"error": "permission_denied", "message": "No access"})
+        self.assertEqual(PiperClient._parse_api_error(resp), ("permission_denied", "No access", {"error": "permission_denied", "message": "No access"}))
+
+    def test_parse_api_error_non_json_body(self):
+        resp = mock_response(502, text_data="Bad Gateway")
+        self.assertEqual(PiperClient._parse_api_error(resp), ("http_502", "Bad Gateway", "Bad Gateway"))
+        empty_resp = mock_response(500, text_data="")
+        self.assertEqual(PiperClient._parse_api_error(empty_resp, "Raw Secret Exchange GCF Error"), ("http_500", "Raw Secret Exchange GCF Error 500", ""))
+
     def test_get_secret_on_client_with_init_failure_client_id(self): # No change
         bad_client = PiperClient(client_id=None) # type: ignore
         with self.assertRaisesRegex(PiperConfigError, "client_id is required"):
@@ -166,8 +187,83 @@ class TestPiperClientRegression(unittest.TestCase): # Mostly same, one fix
         with self.assertRaisesRegex(PiperConfigError, "must be a valid HTTPS URL"):
             bad_client.get_secret(self.variable_name, raise_on_failure=True)
 
+    def test_init_mounts_pooled_adapter_on_own_session(self):
+        client = PiperClient(client_id=self.client_id, http_pool_connections=2, http_pool_maxsize=16)
+        adapter = client._session.get_adapter(self.resolve_url)
+        self.assertIsInstance(adapter, requests.adapters.HTTPAdapter)
+        self.assertEqual(adapter._pool_connections, 2)
+        self.assertEqual(adapter._pool_maxsize, 16)
+        self.assertEqual(client._session.get_adapter(PiperClient.DEFAULT_PIPER_LINK_SERVICE_URL)._pool_maxsize, 16)
+
+    def test_init_retries_transient_errors_on_https_only(self):
+        client = PiperClient(client_id=self.client_id, max_retries=5)
+        https_retry = client._session.get_adapter(self.resolve_url).max_retries
+        self.assertEqual(https_retry.total, 5)
+        self.assertEqual(set(https_retry.status_forcelist), {502, 503, 504})
+        self.assertIn('POST', https_retry.allowed_methods)
+        self.assertFalse(https_retry.raise_on_status)
+        link_retry = client._session.get_adapter(PiperClient.DEFAULT_PIPER_LINK_SERVICE_URL).max_retries
+        self.assertEqual(link_retry.total, 0)
+
+    def test_init_accepts_custom_retry(self):
+        custom_retry = Retry(total=1)
+        client = PiperClient(client_id=self.client_id, max_retries=custom_retry)
+        self.assertIs(client._session.get_adapter(self.resolve_url).max_retries, custom_retry)
+
+    @patch('requests.Session.head')
+    def test_prewarm_heads_each_piper_endpoint(self, mock_head):
+        mock_head.side_effect = [mock_response(405), requests.exceptions.ConnectionError("down"), mock_response(200)]
+        self.assertEqual(self.client.prewarm(), 2)
+        self.assertEqual([c[0][0] for c in mock_head.call_args_list], [self.resolve_url, self.scoped_url, self.exchange_url])
+
+    @patch('requests.Session.head', return_value=mock_response(200))
+    @patch('requests.Session.get')
+    def test_prewarm_can_cache_local_discovery(self, mock_get, mock_head):
+        mock_get.return_value = mock_response(200, {"instanceId": self.instance_id})
+        self.client.prewarm()
+        mock_get.assert_not_called()
+        self.assertEqual(self.client.prewarm(discover_instance=True), 3)
+        self.assertEqual(self.client._discovered_instance_id, self.instance_id)
+        PiperClient(client_id=self.client_id, piper_link_instance_id="configured").prewarm(discover_instance=True)
+        mock_get.assert_called_once()
+
+    @patch('requests.Session.head')
+    def test_prewarm_skipped_when_piper_disabled(self, mock_head):
+        client = PiperClient(client_id=self.client_id, use_piper=False)
+        self.assertEqual(client.prewarm(), 0)
+        mock_head.assert_not_called()
+
+    def test_init_leaves_provided_session_adapters_untouched(self):
+        session = requests.Session()
+        original_adapter = session.get_adapter(self.resolve_url)
+        client = PiperClient(client_id=self.client_id, requests_session=session)
+        self.assertIs(client._session, session)
+        self.assertIs(client._session.get_adapter(self.resolve_url), original_adapter)
+
+    def test_create_session_can_be_shared_between_clients(self):
+        session = create_session(pool_maxsize=8, max_retries=1)
+        self.assertEqual(session.get_adapter(self.resolve_url)._pool_maxsize, 8)
+        self.assertEqual(session.get_adapter(self.resolve_url).max_retries.total, 1)
+        clients = [PiperClient(client_id=self.client_id, requests_session=session) for _ in range(2)]
+        self.assertTrue(all(c._session is session for c in clients))
+        with patch.object(session, 'close') as mock_close:
+            for c in clients: c.close()
+        mock_close.assert_not_called()
+        session.close()
+
+    def test_sdk_logger_only_installs_null_handler(self):
+        import logging
+        sdk_logger = logging.getLogger('piper_sdk.client')
+        self.assertTrue(sdk_logger.propagate)
+        self.assertEqual(sdk_logger.level, logging.NOTSET)
+        self.assertTrue(all(isinstance(h, logging.NullHandler) for h in sdk_logger.handlers))
+
 class TestPiperClientGracefulFeatures(unittest.TestCase): # Some tests updated
     def setUp(self):
+        _LINK_DISCOVERY_CACHE.clear()
+        probe_patcher = patch('piper_sdk.client.PiperClient._piper_link_refuses_connections', return_value=False) # Discovery here is mocked at the HTTP layer
+        probe_patcher.start()
+        self.addCleanup(probe_patcher.stop)
         self.client_id = "graceful_agent_id_456"
         self.variable_name = "GRACEFUL_VAR"
         self.normalized_variable_name = "graceful_var"
@@ -193,6 +289,12 @@ class TestPiperClientGracefulFeatures(unittest.TestCase): # Some tests updated
         self.assertFalse(client.client_initialization_ok)
         self.assertIsInstance(client._initialization_error, PiperConfigError)
         
+    @patch('requests.Session.get')
+    def test_init_does_not_block_on_local_discovery(self, mock_get):
+        client = PiperClient(client_id=self.client_id, attempt_local_discovery=True)
+        mock_get.assert_not_called()
+        self.assertIsNone(client._discovered_instance_id)
+
     def test_init_multiple_config_errors_stores_first(self): # No change
         client = PiperClient(client_id=None, resolve_mapping_url="http://bad.url") # type: ignore
         self.assertFalse(client.client_initialization_ok)
@@ -218,9 +320,9 @@ class TestPiperClientGracefulFeatures(unittest.TestCase): # Some tests updated
 
     @patch('requests.Session.post')
     @patch('piper_sdk.client.PiperClient.discover_local_instance_id')
-    @patch('os.environ.get', return_value=None)
+    @patch.dict(os.environ, {}, clear=True)
     @patch('os.path.exists', return_value=False)
-    def test_get_secret_non_raising_all_tiers_fail_stores_psae(self, mock_exists, mock_env_get, mock_discover_id, mock_post): # Updated assertion for source
+    def test_get_secret_non_raising_all_tiers_fail_stores_psae(self, mock_exists, mock_discover_id, mock_post): # Updated assertion for source
         mock_discover_id.return_value = self.instance_id 
         mock_resolve_fail_resp = mock_response(404, {"error": "mapping_not_found"})
         mock_post.return_value = mock_resolve_fail_resp
@@ -234,7 +336,7 @@ class TestPiperClientGracefulFeatures(unittest.TestCase): # Some tests updated
         mock_discover_id.return_value = self.instance_id
         mock_resolve_fail_resp = mock_response(404, {"error": "mapping_not_found"})
         mock_post.return_value = mock_resolve_fail_resp
-        with patch('os.environ.get', return_value=None), patch('os.path.exists', return_value=False):
+        with patch.dict(os.environ, {}, clear=True), patch('os.path.exists', return_value=False):
             self.client.get_secret(self.variable_name, raise_on_failure=False)
         mock_resolve_resp = mock_response(200, {"credentialId": self.credential_id})
         mock_scoped_resp = mock_response(200, {"access_token": self.sts_token, "granted_credential_ids": [self.credential_id]})
@@ -343,6 +445,77 @@ class TestPiperClientGracefulFeatures(unittest.TestCase): # Some tests updated
         self.assertIsNone(client_with_config_id._discovered_instance_id) # Discovered should be cleared
 
 
+    def test_discover_local_instance_id_concurrent_callers_share_one_request(self):
+        barrier = threading.Barrier(4)
+        def slow_get(*args, **kwargs):
+            time.sleep(0.05)
+            return mock_response(200, {"instanceId": self.instance_id})
+        with patch.object(self.client._session, 'get', side_effect=slow_get) as mock_get:
+            results = []
+            def worker():
+                barrier.wait()
+                results.append(self.client.discover_local_instance_id())
+            threads = [threading.Thread(target=worker) for _ in range(4)]
+            for t in threads: t.start()
+            for t in threads: t.join()
+        self.assertEqual(results, [self.instance_id] * 4)
+        mock_get.assert_called_once()
+
+
+    def test_discover_local_instance_id_failure_is_negatively_cached(self):
+        with patch.object(self.client._session, 'get', side_effect=requests.exceptions.ConnectionError("refused")) as mock_get:
+            self.assertIsNone(self.client.discover_local_instance_id())
+            self.assertIsNone(self.client.discover_local_instance_id())
+            mock_get.assert_called_once()
+            self.assertIsNone(self.client.discover_local_instance_id(force_refresh=True))
+            self.assertEqual(mock_get.call_count, 2)
+
+    def test_discover_local_instance_id_retries_after_negative_ttl(self):
+        with patch.object(self.client._session, 'get', side_effect=requests.exceptions.ConnectionError("refused")):
+            self.client.discover_local_instance_id()
+        with patch('piper_sdk.client.time.monotonic', return_value=time.monotonic() + PiperClient.DEFAULT_DISCOVERY_NEGATIVE_TTL_SECONDS + 1), \
+             patch.object(self.client._session, 'get', return_value=mock_response(200, {"instanceId": self.instance_id})) as mock_get:
+            self.assertEqual(self.client.discover_local_instance_id(), self.instance_id)
+            mock_get.assert_called_once()
+
+    def test_discovery_negative_ttl_is_configurable(self):
+        for ttl, expected_calls in ((0, 2), (60, 1)):
+            _LINK_DISCOVERY_CACHE.clear() # Isolate each client from the failure the previous one shared
+            client = PiperClient(client_id=self.client_id, discovery_negative_ttl=ttl)
+            with patch.object(client._session, 'get', side_effect=requests.exceptions.ConnectionError("refused")) as mock_get:
+                client.discover_local_instance_id()
+                client.discover_local_instance_id()
+            self.assertEqual(mock_get.call_count, expected_calls)
+
+    def test_discovery_result_is_shared_between_clients(self):
+        with patch('requests.Session.get', side_effect=requests.exceptions.ConnectionError("refused")) as mock_get:
+            self.assertIsNone(PiperClient(client_id=self.client_id).discover_local_instance_id())
+            self.assertIsNone(PiperClient(client_id=self.client_id).discover_local_instance_id())
+            mock_get.assert_called_once()
+        with patch('requests.Session.get', return_value=mock_response(200, {"instanceId": self.instance_id})) as mock_get:
+            first = PiperClient(client_id=self.client_id)
+            first.clear_cached_instance_id()
+            self.assertEqual(first.discover_local_instance_id(), self.instance_id)
+            self.assertEqual(PiperClient(client_id=self.client_id).discover_local_instance_id(), self.instance_id)
+            PiperClient(client_id=self.client_id, piper_link_service_url="http://localhost:1/other").discover_local_instance_id()
+            self.assertEqual(mock_get.call_count, 2)
+
+    def test_shared_discovery_failure_uses_each_readers_negative_ttl(self):
+        with patch('requests.Session.get', side_effect=requests.exceptions.ConnectionError("refused")) as mock_get:
+            PiperClient(client_id=self.client_id, discovery_negative_ttl=60).discover_local_instance_id()
+            eager_retry_client = PiperClient(client_id=self.client_id, discovery_negative_ttl=0)
+            eager_retry_client.discover_local_instance_id()
+            eager_retry_client.discover_local_instance_id()
+            self.assertEqual(mock_get.call_count, 3)
+            PiperClient(client_id=self.client_id, discovery_negative_ttl=60).discover_local_instance_id()
+            self.assertEqual(mock_get.call_count, 3)
+
+    def test_clear_cached_instance_id_resets_discovery_failure(self):
+        self.client._discovery_failed_at = time.monotonic()
+        self.client.clear_cached_instance_id()
+        self.assertIsNone(self.client._discovery_failed_at)
+
+
     # --- Tests for clear_last_error_for_variable ---
     def test_clear_last_error_for_variable_clears_existing_error(self):
         error_key = self.variable_name
@@ -405,7 +578,7 @@ class TestPiperClientGracefulFeatures(unittest.TestCase): # Some tests updated
         self.assertTrue(is_active)
         mock_post.assert_called_once()
         self.assertEqual(mock_post.call_args[0][0], self.client.resolve_mapping_url)
-        self.assertEqual(mock_post.call_args[1]['json']['variableName'], self.normalized_variable_name)
+        self.assertEqual(json.loads(mock_post.call_args[1]['data'])['variableName'], self.normalized_variable_name)
         self.assertIsNone(self.client.get_last_error_for_variable(self.variable_name)) # Error should be cleared
 
 
@@ -476,6 +649,426 @@ class TestPiperClientGracefulFeatures(unittest.TestCase): # Some tests updated
             self.client.is_grant_still_active("   ")
 
 
+    # --- Tests for credentialId caching and batched scoped credentials ---
+    @patch('requests.Session.post')
+    def test_get_secret_reuses_cached_credential_id(self, mock_post):
+        mock_post.side_effect = [
+            mock_response(200, {"credentialId": self.credential_id}),
+            mock_response(200, {"access_token": self.sts_token, "granted_credential_ids": [self.credential_id]}),
+            mock_response(200, {"access_token": self.sts_token, "granted_credential_ids": [self.credential_id]}),
+        ]
+        self.client.get_secret(self.variable_name, piper_link_instance_id_for_call=self.instance_id)
+        self.client.get_secret(self.variable_name, piper_link_instance_id_for_call=self.instance_id)
+        called_urls = [c[0][0] for c in mock_post.call_args_list]
+        self.assertEqual(called_urls, [self.client.resolve_mapping_url, self.client.get_scoped_url, self.client.get_scoped_url])
+
+    @patch('requests.Session.post')
+    def test_get_secret_sts_forbidden_drops_cached_credential_id(self, mock_post):
+        self.client._var_to_cred[(self.instance_id, self.normalized_variable_name)] = (self.credential_id, time.monotonic())
+        mock_post.return_value = mock_response(403, {"error": "permission_denied"})
+        with patch.dict(os.environ, {}, clear=True):
+            self.client.get_secret(self.variable_name, piper_link_instance_id_for_call=self.instance_id, raise_on_failure=False)
+        self.assertNotIn((self.instance_id, self.normalized_variable_name), self.client._var_to_cred)
+
+    @patch('requests.Session.post')
+    def test_get_secret_reuses_unexpired_sts_token(self, mock_post):
+        mock_post.side_effect = [
+            mock_response(200, {"credentialId": self.credential_id}),
+            mock_response(200, {"access_token": self.sts_token, "granted_credential_ids": [self.credential_id], "expires_in": 900}),
+        ]
+        self.client.get_secret(self.variable_name, piper_link_instance_id_for_call=self.instance_id)
+        second = self.client.get_secret(self.variable_name, piper_link_instance_id_for_call=self.instance_id)
+        self.assertEqual(mock_post.call_count, 2)
+        self.assertEqual((second["value"], second["source"]), (self.sts_token, "piper_sts"))
+        self.assertLessEqual(second["expires_in"], 900)
+        second["value"] = "mutated by caller"
+        self.assertEqual(self.client.get_secret(self.variable_name, piper_link_instance_id_for_call=self.instance_id)["value"], self.sts_token)
+
+    @patch('requests.Session.post')
+    def test_sts_cache_respects_expiry_buffer_and_auth_errors(self, mock_post):
+        mock_post.side_effect = [
+            mock_response(200, {"credentialId": self.credential_id}),
+            mock_response(200, {"access_token": self.sts_token, "granted_credential_ids": [self.credential_id], "expires_in": 900}),
+            mock_response(401, {"error": "unauthorized"}),
+        ]
+        self.client.get_secret(self.variable_name, piper_link_instance_id_for_call=self.instance_id)
+        for key, (info, _) in list(self.client._sts_cache.items()):
+            self.client._sts_cache[key] = (info, time.monotonic() + self.client.DEFAULT_STS_EXPIRY_BUFFER_SECONDS - 1)
+        with patch.dict(os.environ, {}, clear=True):
+            result = self.client.get_secret(self.variable_name, piper_link_instance_id_for_call=self.instance_id, raise_on_failure=False)
+        self.assertIsNone(result["value"])
+        self.assertEqual(mock_post.call_count, 3)
+        self.assertEqual(self.client._sts_cache, {})
+        self.assertEqual(self.client._var_to_cred, {})
+
+    @patch('requests.Session.post')
+    def test_sts_expiry_buffer_is_configurable(self, mock_post):
+        client = PiperClient(client_id=self.client_id, sts_expiry_buffer=300)
+        mock_post.side_effect = [
+            mock_response(200, {"credentialId": self.credential_id}),
+            mock_response(200, {"access_token": "short_lived", "granted_credential_ids": [self.credential_id], "expires_in": 200}),
+            mock_response(200, {"access_token": self.sts_token, "granted_credential_ids": [self.credential_id], "expires_in": 900}),
+        ]
+        for _ in range(3): result = client.get_secret(self.variable_name, piper_link_instance_id_for_call=self.instance_id)
+        self.assertEqual(result["value"], self.sts_token)
+        self.assertEqual(mock_post.call_count, 3)
+
+    @patch('requests.Session.post')
+    def test_raw_secrets_are_cached_only_when_enabled(self, mock_post):
+        def post(url, **kwargs):
+            if url == self.client.resolve_mapping_url: return mock_response(200, {"credentialId": self.credential_id})
+            if url == self.client.get_scoped_url: return mock_response(200, {"access_token": self.sts_token, "granted_credential_ids": [self.credential_id], "expires_in": 900})
+            return mock_response(200, {"secret_value": self.raw_secret})
+        mock_post.side_effect = post
+        for _ in range(2): self.client.get_secret(self.variable_name, piper_link_instance_id_for_call=self.instance_id, fetch_raw_secret=True)
+        self.assertEqual(mock_post.call_count, 5)
+        client = PiperClient(client_id=self.client_id, cache_raw_secrets=True)
+        for _ in range(2): self.assertEqual(client.get_secret(self.variable_name, piper_link_instance_id_for_call=self.instance_id, fetch_raw_secret=True)["value"], self.raw_secret)
+        self.assertEqual(mock_post.call_count, 8)
+
+    @patch('requests.Session.post')
+    def test_resolve_cache_entry_expires_after_ttl(self, mock_post):
+        mock_post.return_value = mock_response(200, {"credentialId": self.credential_id})
+        self.client._resolve_piper_variable(self.variable_name, self.instance_id)
+        self.client._resolve_piper_variable(self.variable_name, self.instance_id)
+        self.assertEqual(mock_post.call_count, 1)
+        cache_key = (self.instance_id, self.normalized_variable_name)
+        self.client._var_to_cred[cache_key] = (self.credential_id, time.monotonic() - self.client.resolve_cache_ttl - 1)
+        self.client._resolve_piper_variable(self.variable_name, self.instance_id)
+        self.assertEqual(mock_post.call_count, 2)
+
+    @patch('requests.Session.post')
+    def test_resolve_cache_ttl_zero_disables_cache(self, mock_post):
+        client = PiperClient(client_id=self.client_id, resolve_cache_ttl=0)
+        mock_post.return_value = mock_response(200, {"credentialId": self.credential_id})
+        client._resolve_piper_variable(self.variable_name, self.instance_id)
+        client._resolve_piper_variable(self.variable_name, self.instance_id)
+        self.assertEqual(mock_post.call_count, 2)
+        self.assertEqual(client._var_to_cred, {})
+
+    @patch('requests.Session.post')
+    def test_grant_needed_cache_ttl_remembers_missing_mapping(self, mock_post):
+        client = PiperClient(client_id=self.client_id, grant_needed_cache_ttl=10)
+        mock_post.return_value = mock_response(404, {"error": "mapping_not_found"})
+        for _ in range(2):
+            with self.assertRaises(PiperGrantNeededError) as cm:
+                client._resolve_piper_variable(self.variable_name, self.instance_id)
+        self.assertEqual(mock_post.call_count, 1)
+        self.assertEqual(cm.exception.error_details, {"error": "mapping_not_found"})
+        self.assertIsNotNone(cm.exception.constructed_grant_url)
+        client.clear_last_error_for_variable(self.variable_name)
+        mock_post.return_value = mock_response(200, {"credentialId": self.credential_id})
+        self.assertEqual(client._resolve_piper_variable(self.variable_name, self.instance_id), self.credential_id)
+
+    def test_invalidate_resolve_cache(self):
+        expiry = time.monotonic()
+        self.client._var_to_cred.update({("inst_1", "var_a"): ("cred_a", expiry), ("inst_2", "var_a"): ("cred_a2", expiry), ("inst_1", "var_b"): ("cred_b", expiry)})
+        self.client.invalidate_resolve_cache(" VAR_A ")
+        self.assertEqual(list(self.client._var_to_cred), [("inst_1", "var_b")])
+        self.client.invalidate_resolve_cache(123)
+        self.assertEqual(list(self.client._var_to_cred), [("inst_1", "var_b")])
+        self.client.invalidate_resolve_cache()
+        self.assertEqual(self.client._var_to_cred, {})
+
+    @patch('requests.Session.post')
+    def test_is_grant_still_active_bypasses_credential_id_cache(self, mock_post):
+        self.client._var_to_cred[(self.instance_id, self.normalized_variable_name)] = (self.credential_id, time.monotonic())
+        mock_post.return_value = mock_response(404, {"error": "mapping_not_found"})
+        self.assertFalse(self.client.is_grant_still_active(self.variable_name, piper_link_instance_id_for_call=self.instance_id))
+        self.assertNotIn((self.instance_id, self.normalized_variable_name), self.client._var_to_cred)
+
+    @patch('requests.Session.post')
+    def test_get_scoped_credentials_for_variables_single_sts_call(self, mock_post):
+        self.client._var_to_cred[(self.instance_id, "cached_var")] = ("cred_cached", time.monotonic())
+        def post(url, **kwargs):
+            if url == self.client.resolve_mapping_url:
+                return mock_response(200, {"credentialId": f"cred_{json.loads(kwargs['data'])['variableName']}"})
+            return mock_response(200, {"access_token": self.sts_token, "granted_credential_ids": json.loads(kwargs['data'])['credentialIds']})
+        mock_post.side_effect = post
+        result = self.client.get_scoped_credentials_for_variables(["CACHED_VAR", "VAR_A", "VAR_B", " VAR_A "], piper_link_instance_id_for_call=self.instance_id)
+        self.assertEqual(result["credential_ids_by_variable"], {"CACHED_VAR": "cred_cached", "VAR_A": "cred_var_a", "VAR_B": "cred_var_b"})
+        scoped_calls = [c for c in mock_post.call_args_list if c[0][0] == self.client.get_scoped_url]
+        self.assertEqual(len(scoped_calls), 1)
+        self.assertEqual(json.loads(scoped_calls[0][1]['data'])['credentialIds'], ["cred_cached", "cred_var_a", "cred_var_b"])
+        self.assertEqual(mock_post.call_count, 3)
+
+    @patch('requests.Session.post')
+    def test_get_scoped_credentials_by_id_partial_grant_logs_missing_ids(self, mock_post):
+        mock_post.return_value = mock_response(200, {"access_token": self.sts_token, "granted_credential_ids": ["cred_b"]})
+        with self.assertLogs('piper_sdk.client', level='WARNING') as logs:
+            self.client.get_scoped_credentials_by_id(["cred_a", "cred_b"], piper_link_instance_id_for_call=self.instance_id)
+        self.assertTrue(any("Partial success" in line and "['cred_a']" in line for line in logs.output))
+
+    @patch('requests.Session.post')
+    def test_get_scoped_credentials_by_id_reordered_grant_is_not_partial(self, mock_post):
+        mock_post.return_value = mock_response(200, {"access_token": self.sts_token, "granted_credential_ids": ["cred_b", "cred_a"]})
+        with patch('piper_sdk.client.logger.warning') as mock_warning:
+            self.client.get_scoped_credentials_by_id(["cred_a", "cred_b", "cred_a"], piper_link_instance_id_for_call=self.instance_id)
+        self.assertFalse(any("Partial success" in str(c) for c in mock_warning.call_args_list))
+
+    @patch('requests.Session.post')
+    def test_get_scoped_credentials_for_variables_reuses_executor(self, mock_post):
+        def post(url, **kwargs):
+            if url == self.client.resolve_mapping_url:
+                return mock_response(200, {"credentialId": f"cred_{json.loads(kwargs['data'])['variableName']}"})
+            return mock_response(200, {"access_token": self.sts_token, "granted_credential_ids": json.loads(kwargs['data'])['credentialIds']})
+        mock_post.side_effect = post
+        self.client.get_scoped_credentials_for_variables(["VAR_A", "VAR_B"], piper_link_instance_id_for_call=self.instance_id)
+        first_executor = self.client._executor
+        self.assertIsNotNone(first_executor)
+        self.client.get_scoped_credentials_for_variables(["VAR_C", "VAR_D"], piper_link_instance_id_for_call=self.instance_id)
+        self.assertIs(self.client._executor, first_executor)
+
+    def test_close_shuts_down_executor_and_supports_context_manager(self):
+        with PiperClient(client_id=self.client_id) as client:
+            executor = client._get_executor()
+        self.assertIsNone(client._executor)
+        with self.assertRaises(RuntimeError):
+            executor.submit(lambda: None)
+        client.close() # Idempotent
+
+    def test_close_closes_owned_session_only(self):
+        with patch('requests.Session.close') as mock_close:
+            PiperClient(client_id=self.client_id).close()
+            self.assertEqual(mock_close.call_count, 1)
+            PiperClient(client_id=self.client_id, requests_session=requests.Session()).close()
+            self.assertEqual(mock_close.call_count, 1)
+
+    @patch('requests.Session.get')
+    def test_with_fallback_shares_session_caches_and_discovery(self, mock_get):
+        mock_get.return_value = mock_response(200, {"instanceId": self.instance_id})
+        derived = self.client.with_fallback(env_variable_prefix="APP_", env_variable_map={"X": "Y"})
+        self.assertEqual((derived.env_variable_prefix, derived.env_variable_map), ("APP_", {"X": "Y"}))
+        self.assertEqual((self.client.env_variable_prefix, self.client.env_variable_map), ("", {}))
+        self.assertIs(derived._session, self.client._session)
+        self.assertIs(derived._var_to_cred, self.client._var_to_cred)
+        self.assertIs(derived.with_fallback(fallback_to_env=False)._resource_owner, self.client)
+        self.assertEqual(derived.discover_local_instance_id(), self.instance_id)
+        self.assertEqual(self.client.discover_local_instance_id(), self.instance_id)
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertIs(derived._get_executor(), self.client._get_executor())
+        derived._last_get_secret_errors["X"] = PiperError("only on derived")
+        self.assertIsNone(self.client.get_last_error_for_variable("X"))
+        derived.close()
+        self.assertIsNotNone(self.client._executor)
+        with self.assertRaisesRegex(PiperConfigError, "local_config_file_path must be provided"):
+            self.client.with_fallback(fallback_to_local_config=True)
+
+    def test_snapshot_env_reads_copy_until_refreshed(self):
+        with patch.dict(os.environ, {"SNAP_KEY": "at_init"}, clear=True):
+            client = PiperClient(client_id=self.client_id, use_piper=False, snapshot_env=True)
+            os.environ["SNAP_KEY"] = "changed"
+            self.assertEqual(client.get_secret("SNAP_KEY")["value"], "at_init")
+            client.refresh_env()
+            self.assertEqual(client.get_secret("SNAP_KEY")["value"], "changed")
+
+    def test_refresh_env_reaches_derived_clients(self):
+        with patch.dict(os.environ, {"SNAP_KEY": "at_init"}, clear=True):
+            client = PiperClient(client_id=self.client_id, use_piper=False, snapshot_env=True)
+            derived = client.with_fallback(env_variable_prefix="")
+            os.environ["SNAP_KEY"] = "changed"
+            client.refresh_env()
+            self.assertEqual(derived.get_secret("SNAP_KEY")["value"], "changed")
+            os.environ["SNAP_KEY"] = "changed_again"
+            derived.refresh_env()
+            self.assertEqual(client.get_secret("SNAP_KEY")["value"], "changed_again")
+
+    def test_init_summary_is_not_built_when_info_logging_is_off(self):
+        with patch('piper_sdk.client.logger.isEnabledFor', return_value=False), patch('piper_sdk.client.logger.info') as mock_info:
+            PiperClient(client_id=self.client_id)
+        mock_info.assert_not_called()
+
+    def test_get_secrets_fetches_each_name_concurrently(self):
+        seen_threads = set()
+        def fake_get_secret(name, instance_id, fetch_raw, raise_on_failure):
+            seen_threads.add(threading.current_thread().name)
+            if name == "MISSING": return {"value": None, "source": "piper_grant_needed"}
+            return {"value": f"value_of_{name}", "source": "piper_sts"}
+        with patch.object(self.client, 'get_secret', side_effect=fake_get_secret) as mock_get_secret:
+            results = self.client.get_secrets(["A", "MISSING", "B", "A"], raise_on_failure=False)
+        self.assertEqual(list(results), ["A", "MISSING", "B"])
+        self.assertEqual(results["B"]["value"], "value_of_B")
+        self.assertIsNone(results["MISSING"]["value"])
+        self.assertEqual(mock_get_secret.call_count, 3)
+        self.assertTrue(all(name.startswith('piper-sdk') for name in seen_threads))
+        with self.assertRaisesRegex(PiperConfigError, "variable_names must be a non-empty list"):
+            self.client.get_secrets([])
+
+    def test_get_secrets_raises_first_failure_by_default(self):
+        with patch.dict(os.environ, {"PRESENT": "1"}, clear=True):
+            client = PiperClient(client_id=self.client_id, use_piper=False)
+            with self.assertRaises(PiperSecretAcquisitionError) as cm:
+                client.get_secrets(["PRESENT", "ABSENT"])
+        self.assertEqual(cm.exception.variable_name, "ABSENT")
+
+    def test_env_fallback_name_is_memoized_per_prefix(self):
+        client = PiperClient(client_id=self.client_id, use_piper=False, env_variable_prefix="MYAPP_", env_variable_map={"Mapped": "EXPLICIT_NAME"})
+        with patch.dict(os.environ, {"MYAPP_GMAIL_KEY": "from_env", "EXPLICIT_NAME": "mapped_value"}, clear=True):
+            self.assertEqual(client.get_secret("Gmail key")["env_var_name_used"], "MYAPP_GMAIL_KEY")
+            self.assertEqual(client.get_secret("Mapped")["value"], "mapped_value")
+        self.assertEqual(client._env_name_cache, {("MYAPP_", "Gmail key"): "MYAPP_GMAIL_KEY"})
+        derived = client.with_fallback(env_variable_prefix="OTHER_")
+        self.assertEqual(derived._resolve_env_fallback_name("Gmail key"), "OTHER_GMAIL_KEY")
+        self.assertEqual(client._resolve_env_fallback_name("Gmail key"), "MYAPP_GMAIL_KEY")
+        client.env_variable_prefix = "REASSIGNED_"
+        self.assertEqual(client._resolve_env_fallback_name("Gmail key"), "REASSIGNED_GMAIL_KEY")
+
+    def test_with_overrides_changes_only_named_settings(self):
+        derived = self.client.with_overrides(use_piper=False, piper_link_instance_id="inst_override", local_config_file_path="~/secrets.json", fallback_to_local_config=True)
+        self.assertEqual((derived.use_piper, derived._configured_instance_id), (False, "inst_override"))
+        self.assertEqual(derived.local_config_file_path, os.path.expanduser("~/secrets.json"))
+        self.assertEqual((self.client.use_piper, self.client._configured_instance_id, self.client.fallback_to_local_config), (True, None, False))
+        self.assertIs(derived._session, self.client._session)
+        self.assertIs(derived._sts_cache, self.client._sts_cache)
+        self.assertIs(derived._resource_owner, self.client)
+        with self.assertRaisesRegex(PiperConfigError, "cannot change client_id"):
+            self.client.with_overrides(client_id="other")
+
+    @patch('requests.Session.get')
+    def test_with_overrides_applies_its_own_discovery_negative_ttl(self, mock_get):
+        mock_get.side_effect = requests.exceptions.ConnectionError("link down")
+        self.assertIsNone(self.client.discover_local_instance_id())
+        eager = self.client.with_overrides(discovery_negative_ttl=0)
+        self.assertIsNone(eager.discover_local_instance_id())
+        self.assertEqual(mock_get.call_count, 2)
+        mock_get.side_effect = None
+        mock_get.return_value = mock_response(200, {"instanceId": self.instance_id})
+        self.assertIsNone(self.client.discover_local_instance_id())
+        self.assertEqual(eager.discover_local_instance_id(), self.instance_id)
+        self.assertEqual(self.client.discover_local_instance_id(), self.instance_id)
+        self.assertEqual(mock_get.call_count, 3)
+
+    def test_with_overrides_resolve_cache_ttl_zero_skips_shared_credential_ids(self):
+        cache_key = (self.instance_id, self.normalized_variable_name)
+        self.client._var_to_cred[cache_key] = (self.credential_id, time.monotonic())
+        uncached = self.client.with_overrides(resolve_cache_ttl=0)
+        self.assertEqual(uncached._lookup_credential_id(self.variable_name, self.instance_id, True), (self.normalized_variable_name, None))
+        self.assertEqual(uncached._split_cached_credential_ids([self.variable_name], self.instance_id), ({}, [self.variable_name]))
+        self.assertEqual(self.client._lookup_credential_id(self.variable_name, self.instance_id, True), (self.normalized_variable_name, self.credential_id))
+        self.client._var_to_cred[cache_key] = (self.credential_id, time.monotonic() - 20)
+        self.assertIsNone(self.client.with_overrides(resolve_cache_ttl=10)._cached_credential_id(cache_key))
+
+    @patch('requests.Session.post')
+    def test_with_overrides_grant_needed_cache_ttl_zero_asks_piper_again(self, mock_post):
+        client = PiperClient(client_id=self.client_id, grant_needed_cache_ttl=60)
+        mock_post.return_value = mock_response(404, {"error": "mapping_not_found"})
+        with self.assertRaises(PiperGrantNeededError):
+            client._resolve_piper_variable(self.variable_name, self.instance_id)
+        mock_post.return_value = mock_response(200, {"credentialId": self.credential_id})
+        self.assertEqual(client.with_overrides(grant_needed_cache_ttl=0)._resolve_piper_variable(self.variable_name, self.instance_id), self.credential_id)
+        self.assertEqual(mock_post.call_count, 2)
+
+    def test_get_scoped_credentials_for_variables_invalid_input_raises(self):
+        with self.assertRaisesRegex(PiperConfigError, "variable_names must be a non-empty list"):
+            self.client.get_scoped_credentials_for_variables([])
+        with self.assertRaisesRegex(PiperConfigError, "variable_names must be a non-empty list"):
+            self.client.get_scoped_credentials_for_variables(["OK", "  "])
+
+    def test_status_error_str_is_cached_and_invalidated_on_update(self):
+        err = PiperAuthError("Denied", status_code=401, error_code="unauthorized", error_details={"k": "v"})
+        self.assertEqual(str(err), "Denied (Status: 401) (Code: unauthorized), Details: {'k': 'v'}")
+        self.assertIs(str(err), str(err))
+        err.status_code = 403
+        self.assertEqual(str(err), "Denied (Status: 403) (Code: unauthorized), Details: {'k': 'v'}")
+        grant_err = PiperGrantNeededError("No mapping", status_code=404, agent_id_for_grant="agent")
+        grant_err.variable_name_requested = "MY_VAR"
+        self.assertIn("(for variable: 'MY_VAR')", str(grant_err))
+        self.assertEqual(str(PiperRawSecretExchangeError("Exchange failed", status_code=500)), "Exchange failed (Status: 500)")
+
+    def test_grant_url_matches_full_urlencode(self):
+        from urllib.parse import urlencode, quote_plus
+        for variable in ("MY_VAR", "my var/with&odd=chars", "ünïcode"):
+            err = PiperGrantNeededError("No mapping", agent_id_for_grant="agent id+1", variable_name_requested=variable, piper_ui_grant_url_template=self.grant_ui_url + "/")
+            expected = f"{self.grant_ui_url}?" + urlencode({'response_type': 'code', 'scope': 'manage_grants', 'client': "agent id+1", 'variable': variable}, quote_via=quote_plus)
+            self.assertEqual(err.constructed_grant_url, expected)
+
+    def test_clean_credential_ids_reuses_clean_list(self):
+        clean = ["cred_a", "cred_b"]
+        self.assertIs(self.client._clean_credential_ids(clean), clean)
+        self.assertEqual(self.client._clean_credential_ids([" cred_a ", "", 7, "cred_b"]), ["cred_a", "7", "cred_b"])
+        with self.assertRaisesRegex(ValueError, "empty after cleaning"):
+            self.client._clean_credential_ids(["  ", ""])
+
+    @patch('requests.Session.post')
+    @patch('piper_sdk.client.PiperClient.discover_local_instance_id')
+    def test_explicit_instance_id_for_call_skips_discovery(self, mock_discover_id, mock_post):
+        mock_post.side_effect = lambda url, **kwargs: mock_response(200, {"credentialId": self.credential_id, "access_token": self.sts_token, "granted_credential_ids": [self.credential_id]})
+        self.client.get_secret(self.variable_name, piper_link_instance_id_for_call=self.instance_id)
+        self.client.get_credential_id_for_variable(self.variable_name, piper_link_instance_id_for_call=self.instance_id)
+        self.client.get_scoped_credentials_by_id([self.credential_id], piper_link_instance_id_for_call=self.instance_id)
+        mock_discover_id.assert_not_called()
+        for c in mock_post.call_args_list:
+            self.assertEqual(json.loads(c[1]['data'])['instanceId'], self.instance_id)
+
+
+class TestPiperLinkFallbackIntegration(unittest.TestCase):
+    """Runs get_secret against a real local Piper Link endpoint (ephemeral port); only the HTTPS Piper backend is mocked."""
+    instance_id = "instance_from_local_link"
+
+    @classmethod
+    def setUpClass(cls):
+        instance_id = cls.instance_id
+        class LinkHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = json.dumps({"instanceId": instance_id}).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            def log_message(self, *args): pass
+        cls.link_server = ThreadingHTTPServer(('127.0.0.1', 0), LinkHandler)
+        threading.Thread(target=cls.link_server.serve_forever, daemon=True).start()
+        cls.running_link_url = f"http://127.0.0.1:{cls.link_server.server_address[1]}/piper-link-context"
+        with socket.socket() as unused: # Bound then released, so nothing listens there
+            unused.bind(('127.0.0.1', 0))
+            cls.stopped_link_url = f"http://127.0.0.1:{unused.getsockname()[1]}/piper-link-context"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.link_server.shutdown()
+        cls.link_server.server_close()
+
+    def backend_post(self, grant_exists):
+        def post(url, **kwargs):
+            payload = json.loads(kwargs['data'])
+            self.assertEqual(payload['instanceId'], self.instance_id)
+            if url == PiperClient.DEFAULT_PIPER_RESOLVE_MAPPING_URL:
+                if not grant_exists: return mock_response(404, {"error": "mapping_not_found"})
+                return mock_response(200, {"credentialId": "cred_link"})
+            return mock_response(200, {"access_token": "sts_from_piper", "granted_credential_ids": payload['credentialIds'], "expires_in": 900})
+        return post
+
+    def setUp(self):
+        _LINK_DISCOVERY_CACHE.clear()
+
+    def test_closed_local_link_port_skips_http_request(self):
+        stopped = PiperClient(client_id="integration_agent", piper_link_service_url=self.stopped_link_url)
+        self.assertFalse(PiperClient(client_id="integration_agent", piper_link_service_url=self.running_link_url)._piper_link_refuses_connections())
+        self.assertTrue(stopped._piper_link_refuses_connections())
+        with patch('requests.Session.get') as mock_get:
+            self.assertIsNone(stopped.discover_local_instance_id())
+        mock_get.assert_not_called()
+        with patch('piper_sdk.client.socket.create_connection') as mock_connect:
+            self.assertFalse(PiperClient(client_id="integration_agent", piper_link_service_url="http://link.example.com/ctx")._piper_link_refuses_connections())
+        mock_connect.assert_not_called()
+
+    def test_get_secret_fallback_matrix(self):
+        for link_running, env_var_set, grant_exists in itertools.product((True, False), repeat=3):
+            with self.subTest(link_running=link_running, env_var_set=env_var_set, grant_exists=grant_exists):
+                client = PiperClient(client_id="integration_agent", piper_link_service_url=self.running_link_url if link_running else self.stopped_link_url)
+                environ = {"INTEGRATION_VAR": "value_from_env"} if env_var_set else {}
+                with patch('requests.Session.post', side_effect=self.backend_post(grant_exists)), patch.dict(os.environ, environ, clear=True):
+                    result = client.get_secret("INTEGRATION_VAR", raise_on_failure=False)
+                client.close()
+                if link_running and grant_exists:
+                    self.assertEqual((result["source"], result["value"], result["piper_instance_id"]), ("piper_sts", "sts_from_piper", self.instance_id))
+                elif env_var_set:
+                    self.assertEqual((result["source"], result["value"]), ("environment_variable", "value_from_env"))
+                else:
+                    self.assertEqual(result["source"], "piper_grant_needed" if link_running else "piper_link_needed")
+                    self.assertIsNone(result["value"])
+
 # ... (Rest of TestPiperClientGracefulFeatures and TestPiperClientRegression) ...
 
 if __name__ == '__main__':